@@ -0,0 +1,162 @@
+"""
+Benchmark: the agent loop's own overhead per turn, and its throughput with many
+agents running at once.
+
+ComputerUseAgent runs against the mock Messages API server with canned tools, so
+nothing leaves the machine and no screen is needed. With no server latency the
+time per turn is the loop itself: building and estimating the request, the HTTP
+round trip on localhost, parsing the response and handling the tool results. The
+load test then runs several agents concurrently against a server that takes a
+fixed time per response, and compares the turns per second with the ideal.
+The agents share one event loop, so the gap to the ideal grows with the loop's
+CPU time per turn, most of which is the SDK transforming the request params.
+
+    python -m benchmarks.agent_loop
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import time
+from typing import Any
+
+from PIL import Image
+
+from client_pool import close_clients
+from loop import APIProvider, ComputerUseAgent
+from mock_server import MockMessagesServer
+from tools import ImageData, ToolCollection, ToolResult
+from tools.base import BaseAnthropicTool
+
+CONVERSATIONS = 20
+LOAD_AGENTS = (1, 8, 32)
+LOAD_LATENCY = 0.2  # seconds
+LOAD_DURATION = 3.0  # seconds
+SCREEN_SIZE = (1366, 768)
+
+
+def _screenshot() -> ImageData:
+    image = Image.linear_gradient("L").resize(SCREEN_SIZE).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return ImageData(buffer.getvalue())
+
+
+class _CannedTool(BaseAnthropicTool):
+    """Answers every call with the same result, without touching the machine"""
+
+    def __init__(self, params: dict[str, Any], result: ToolResult):
+        self.params = params
+        self.result = result
+
+    async def __call__(self, **kwargs):
+        return self.result
+
+    def to_params(self):
+        return self.params
+
+
+class _NullHandler:
+    async def handle_tool_output(self, result, tool_id):
+        pass
+
+    async def handle_tool_progress(self, output, tool_id):
+        pass
+
+    async def handle_model_output(self, content):
+        pass
+
+    async def handle_model_output_complete(self, content):
+        pass
+
+    async def handle_api_response(self, response):
+        pass
+
+
+def _tool_collection() -> ToolCollection:
+    width, height = SCREEN_SIZE
+    return ToolCollection(
+        _CannedTool(
+            {
+                "name": "computer",
+                "type": "computer_20241022",
+                "display_width_px": width,
+                "display_height_px": height,
+                "display_number": None,
+            },
+            ToolResult(image=_screenshot()),
+        ),
+        _CannedTool({"name": "bash", "type": "bash_20241022"}, ToolResult(output="hello")),
+        _CannedTool(
+            {"name": "str_replace_editor", "type": "text_editor_20241022"},
+            ToolResult(output="Here's the files and directories up to 2 levels deep in /tmp"),
+        ),
+    )
+
+
+async def _conversation(agent: ComputerUseAgent) -> None:
+    messages = [{"role": "user", "content": [{"type": "text", "text": "Open the browser"}]}]
+    await agent.process_messages(messages, _NullHandler())
+
+
+async def _overhead(stream: bool) -> float:
+    agent = ComputerUseAgent(
+        api_provider=APIProvider.ANTHROPIC,
+        api_key="benchmark",
+        only_n_most_recent_images=3,
+        stream=stream,
+        tool_collection=_tool_collection(),
+    )
+    await _conversation(agent)  # warm up the connection
+    agent.turn_stats.clear()
+    start = time.perf_counter()
+    for _ in range(CONVERSATIONS):
+        await _conversation(agent)
+    return (time.perf_counter() - start) / len(agent.turn_stats)
+
+
+async def _load(server: MockMessagesServer, agents: int) -> float:
+    tools = _tool_collection()
+    deadline = time.perf_counter() + LOAD_DURATION
+
+    async def run_agent():
+        agent = ComputerUseAgent(
+            api_provider=APIProvider.ANTHROPIC,
+            api_key="benchmark",
+            only_n_most_recent_images=3,
+            tool_collection=tools,
+        )
+        while time.perf_counter() < deadline:
+            await _conversation(agent)
+
+    before = server.request_count
+    start = time.perf_counter()
+    await asyncio.gather(*(run_agent() for _ in range(agents)))
+    return (server.request_count - before) / (time.perf_counter() - start)
+
+
+async def main():
+    with MockMessagesServer() as server:
+        os.environ["ANTHROPIC_BASE_URL"] = server.base_url
+        with contextlib.redirect_stdout(io.StringIO()):
+            per_turn = {stream: await _overhead(stream) for stream in (False, True)}
+        print("loop overhead, no server latency:")
+        print(f"  non-streaming: {per_turn[False] * 1000:6.2f} ms/turn")
+        print(f"  streaming:     {per_turn[True] * 1000:6.2f} ms/turn")
+
+        server.latency = LOAD_LATENCY
+        print(f"\nconcurrent agents, {LOAD_LATENCY * 1000:.0f} ms per response:")
+        for agents in LOAD_AGENTS:
+            with contextlib.redirect_stdout(io.StringIO()):
+                throughput = await _load(server, agents)
+            ideal = agents / LOAD_LATENCY
+            print(
+                f"  {agents:3d} agents: {throughput:7.1f} turns/s "
+                f"(ideal {ideal:7.1f}, {throughput / ideal:5.1%})"
+            )
+        await close_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+"""
+Benchmark: throughput and large-output latency of the bash tool's shell session.
+
+Runs a stream of trivial commands through one BashTool and reports commands per
+second, then times commands that write 1 MB, 10 MB and 50 MB to stdout, which
+the session keeps the head and tail of in memory and streams to a file. The
+session used to poll its output every 200 ms, which capped it at 5 commands/s
+and decoded the whole buffer on every pass.
+
+    python -m benchmarks.bash_session
+"""
+
+import asyncio
+import time
+
+from tools import BashTool
+
+TRIVIAL_COMMANDS = 500
+OUTPUT_SIZES_MB = (1, 10, 50)
+
+
+async def main():
+    tool = BashTool()
+    await tool(command="true")  # start the shell
+
+    start = time.perf_counter()
+    for _ in range(TRIVIAL_COMMANDS):
+        await tool(command="pwd")
+    elapsed = time.perf_counter() - start
+    print(f"trivial commands: {TRIVIAL_COMMANDS / elapsed:8.0f} commands/s ({elapsed / TRIVIAL_COMMANDS * 1e6:.0f} us each)")
+
+    for size in OUTPUT_SIZES_MB:
+        start = time.perf_counter()
+        result = await tool(command=f"yes 0123456789abcdef | head -c {size * 2**20}")
+        elapsed = time.perf_counter() - start
+        assert f"of {size * 2**20} bytes" in result.output  # kept to its head and tail, the rest in a file
+        print(f"{size:>6} MB output: {elapsed * 1000:8.0f} ms")
+    await tool.close()  # and remove the output files
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""
+Benchmark: per-turn connection overhead with a fresh client per turn versus the
+shared client from client_pool.
+
+Runs a series of requests against the mock Messages API server, answering
+immediately, so the time per turn is almost all client and connection
+setup. The server is plain HTTP on localhost; against the real API every fresh
+connection also pays DNS and a TLS handshake on top of this.
+
+    python -m benchmarks.connection_reuse
+"""
+
+import asyncio
+import time
+
+from anthropic import AsyncAnthropic
+
+from client_pool import APIProvider, close_clients, get_client
+from mock_server import MockMessagesServer
+
+TURNS = 50
+MODEL = "claude-3-5-sonnet-20241022"
+SCRIPT = [{"content": [{"type": "text", "text": "done"}]}]
+
+
+async def _request(client) -> None:
+    await client.beta.messages.create(
+        max_tokens=16,
+        messages=[{"role": "user", "content": "hi"}],
+        model=MODEL,
+        betas=["computer-use-2024-10-22"],
+    )
+
+
+async def main():
+    server = MockMessagesServer(SCRIPT).start()
+    base_url = server.base_url
+
+    start = time.perf_counter()
+    for _ in range(TURNS):
+        client = AsyncAnthropic(api_key="benchmark", base_url=base_url)
+        await _request(client)
+        await client.close()
+    fresh = (time.perf_counter() - start) / TURNS
+
+    client = get_client(APIProvider.ANTHROPIC, "benchmark")
+    client.base_url = base_url
+    await _request(client)  # the first turn opens the connection
+    start = time.perf_counter()
+    for _ in range(TURNS):
+        await _request(get_client(APIProvider.ANTHROPIC, "benchmark"))
+    pooled = (time.perf_counter() - start) / TURNS
+    await close_clients()
+    server.stop()
+
+    print(f"fresh client per turn: {fresh * 1000:6.2f} ms/turn")
+    print(f"pooled client:         {pooled * 1000:6.2f} ms/turn")
+    print(f"saved per turn:        {(fresh - pooled) * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
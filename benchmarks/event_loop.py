@@ -0,0 +1,78 @@
+"""
+Benchmark: does the event loop keep running while a model request is in flight?
+
+Starts the mock Messages API server, answering after a fixed delay, then
+issues the same request through the sync and the async client while a heartbeat
+coroutine ticks every few milliseconds. With the sync client the heartbeat stalls
+for the whole request; with the async client it keeps ticking.
+
+    python -m benchmarks.event_loop
+"""
+
+import asyncio
+import time
+
+from anthropic import Anthropic, AsyncAnthropic
+
+from mock_server import MockMessagesServer
+
+REQUEST_DELAY = 1.0  # seconds
+HEARTBEAT_INTERVAL = 0.01  # seconds
+MODEL = "claude-3-5-sonnet-20241022"
+SCRIPT = [{"content": [{"type": "text", "text": "done"}]}]
+
+
+async def _heartbeat(ticks: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        ticks.append(time.perf_counter())
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def _measure(name: str, request) -> None:
+    ticks: list[float] = []
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(ticks, stop))
+    await asyncio.sleep(HEARTBEAT_INTERVAL * 2)
+
+    start = time.perf_counter()
+    await request()
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(HEARTBEAT_INTERVAL * 2)
+
+    stop.set()
+    await heartbeat
+    during = [t for t in ticks if start <= t <= start + elapsed]
+    gaps = [b - a for a, b in zip(ticks, ticks[1:])]
+    print(
+        f"{name:>6}: request {elapsed * 1000:7.1f} ms | "
+        f"heartbeats during request {len(during):4d} | "
+        f"longest stall {max(gaps) * 1000:7.1f} ms"
+    )
+
+
+async def main():
+    server = MockMessagesServer(SCRIPT, latency=REQUEST_DELAY).start()
+    base_url = server.base_url
+
+    params = {
+        "max_tokens": 16,
+        "messages": [{"role": "user", "content": "hi"}],
+        "model": MODEL,
+        "betas": ["computer-use-2024-10-22"],
+    }
+    sync_client = Anthropic(api_key="benchmark", base_url=base_url)
+    async_client = AsyncAnthropic(api_key="benchmark", base_url=base_url)
+
+    async def sync_request():
+        sync_client.beta.messages.create(**params)
+
+    async def async_request():
+        await async_client.beta.messages.create(**params)
+
+    await _measure("sync", sync_request)
+    await _measure("async", async_request)
+    server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+Benchmark: base64 size and encode time of a screenshot in each image format.
+
+Encodes two 1366x768 sample frames, a synthetic desktop of flat UI and text and a
+generated photographic frame, with each encoder setting, and prints the median
+encode time and the base64 bytes that would go into the request.
+
+    python -m benchmarks.image_encoding
+"""
+
+import base64
+import statistics
+import time
+
+from PIL import Image, ImageFilter
+
+from tools.computer import SCALE_DESTINATION
+from tools.encoder import ImageEncoding, encode_image
+from tools.screen import SyntheticBackend, scale_frame
+
+RUNS = 10
+SIZE = (SCALE_DESTINATION["width"], SCALE_DESTINATION["height"])
+
+ENCODINGS = {
+    "png": ImageEncoding(format="png"),
+    "png level 1": ImageEncoding(format="png", png_compress_level=1),
+    "png palette": ImageEncoding(format="png", palette=True),
+    "jpeg q80": ImageEncoding(format="jpeg"),
+    "jpeg q60": ImageEncoding(format="jpeg", quality=60),
+    "webp q80": ImageEncoding(format="webp"),
+    "auto": ImageEncoding(format="auto"),
+}
+
+
+def _photo() -> Image.Image:
+    fractal = Image.effect_mandelbrot(SIZE, (-2.0, -1.2, 1.0, 1.2), 100)
+    noise = Image.effect_noise(SIZE, 60).filter(ImageFilter.GaussianBlur(3))
+    gradient = Image.linear_gradient("L").resize(SIZE)
+    return Image.merge("RGB", [fractal, noise, gradient])
+
+
+def main():
+    frames = {
+        "ui": scale_frame(SyntheticBackend().capture(), SIZE),
+        "photo": _photo(),
+    }
+    print(f"{'frame':>6} {'encoding':>12} {'media type':>11} {'base64 KB':>10} {'encode ms':>10}")
+    for frame_name, image in frames.items():
+        for name, encoding in ENCODINGS.items():
+            timings = []
+            for _ in range(RUNS):
+                start = time.perf_counter()
+                encoded = encode_image(image, encoding)
+                timings.append(time.perf_counter() - start)
+            size = len(base64.b64encode(encoded.data))
+            print(
+                f"{frame_name:>6} {name:>12} {encoded.media_type:>11} "
+                f"{size / 1024:10.1f} {statistics.median(timings) * 1000:10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Micro-benchmark: per-turn cost of pruning old screenshots from the history.
+
+Compares the full-history rescan in loop_original._maybe_filter_to_n_most_recent_images
+with the incremental image index ComputerUseAgent uses for its image retention. Each history is first
+grown to the given number of turns, then the time of one more turn (append an
+assistant message and a screenshot tool_result, then prune) is averaged.
+
+    python -m benchmarks.image_retention
+"""
+
+import asyncio
+import time
+
+from loop import APIProvider, ComputerUseAgent
+from loop_original import _maybe_filter_to_n_most_recent_images
+from tools import ImageData, ToolCollection, ToolResult
+
+HISTORY_TURNS = (1_000, 10_000)
+MEASURED_TURNS = 200
+IMAGES_TO_KEEP = 10
+FAKE_IMAGE = ImageData(b"\x89PNG\r\n\x1a\n" * 8)  # only the block structure matters here
+
+
+def _append_turn(agent: ComputerUseAgent, messages: list, turn: int):
+    tool_use_id = f"toolu_{turn}"
+    messages.append(
+        {
+            "role": "assistant",
+            "content": [
+                {"type": "tool_use", "id": tool_use_id, "name": "computer", "input": {"action": "screenshot"}}
+            ],
+        }
+    )
+    result = ToolResult(output="", image=FAKE_IMAGE)
+    messages.append(
+        {"role": "user", "content": [agent._make_api_tool_result(result, tool_use_id)]}
+    )
+
+
+async def _per_turn_cost(history_turns: int, indexed: bool) -> float:
+    agent = ComputerUseAgent(
+        api_provider=APIProvider.ANTHROPIC,
+        api_key="benchmark",
+        only_n_most_recent_images=IMAGES_TO_KEEP,
+        tool_collection=ToolCollection(),
+    )
+    messages: list = [{"role": "user", "content": [{"type": "text", "text": "go"}]}]
+
+    async def prune():
+        if indexed:
+            await agent._apply_image_retention(messages)
+        else:
+            _maybe_filter_to_n_most_recent_images(messages, IMAGES_TO_KEEP)
+
+    for turn in range(history_turns):
+        _append_turn(agent, messages, turn)
+        if turn % 100 == 0:
+            await prune()
+    await prune()
+
+    start = time.perf_counter()
+    for turn in range(history_turns, history_turns + MEASURED_TURNS):
+        _append_turn(agent, messages, turn)
+        await prune()
+    return (time.perf_counter() - start) / MEASURED_TURNS
+
+
+async def main():
+    print(f"{'turns':>8} | {'full rescan':>14} | {'image index':>14} | speedup")
+    for history_turns in HISTORY_TURNS:
+        rescan = await _per_turn_cost(history_turns, indexed=False)
+        index = await _per_turn_cost(history_turns, indexed=True)
+        print(
+            f"{history_turns:>8} | {rescan * 1e6:11.1f} us | {index * 1e6:11.1f} us | "
+            f"{rescan / index:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
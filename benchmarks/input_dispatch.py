@@ -0,0 +1,56 @@
+"""
+Benchmark: per-action dispatch latency of mouse and keyboard input.
+
+Times actions sent through the InputWorker to the recording driver, which
+measures the worker's own overhead, against the old path of one `/bin/sh`
+spawn per action through tools.run.run (with `true` standing in for cliclick,
+so the process spawn is all that is measured). Also checks the worker ran the
+actions in the order they were submitted.
+
+    python -m benchmarks.input_dispatch
+"""
+
+import asyncio
+import statistics
+import time
+
+from tools.input import InputWorker, RecordingDriver
+from tools.run import run
+
+ACTIONS = 500
+SPAWNS = 100
+
+
+def _report(name: str, timings: list[float]):
+    timings = sorted(t * 1e6 for t in timings)
+    print(
+        f"{name:>16}: p50 {statistics.median(timings):9.1f} us | "
+        f"p95 {timings[int(len(timings) * 0.95) - 1]:9.1f} us"
+    )
+
+
+async def main():
+    driver = RecordingDriver()
+    worker = InputWorker(driver)
+    timings = []
+    for i in range(ACTIONS):
+        start = time.perf_counter()
+        await worker.move(i, i)
+        timings.append(time.perf_counter() - start)
+    _report("input worker", timings)
+
+    await asyncio.gather(*(worker.click("left") if i % 2 else worker.move(i, i) for i in range(ACTIONS)))
+    expected = [("click", "left", 1) if i % 2 else ("move", i, i) for i in range(ACTIONS)]
+    assert driver.events[ACTIONS:] == expected, "actions ran out of order"
+    worker.close()
+
+    timings = []
+    for _ in range(SPAWNS):
+        start = time.perf_counter()
+        await run("true")
+        timings.append(time.perf_counter() - start)
+    _report("process spawn", timings)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+"""
+Benchmark: time and peak memory of tools.run.run on commands with large output.
+
+Runs commands that write 1 MB, 10 MB and 50 MB to stdout through run(), which
+keeps only the head and tail of each stream as it reads, and through the old
+path, which read everything with process.communicate(), decoded it and only
+then cut it down to MAX_RESPONSE_LEN. Peak memory is measured with tracemalloc.
+
+    python -m benchmarks.run_output
+"""
+
+import asyncio
+import time
+import tracemalloc
+
+from tools.run import MAX_RESPONSE_LEN, maybe_truncate, run
+
+OUTPUT_SIZES_MB = (1, 10, 50)
+
+
+async def _communicate(cmd: str):
+    process = await asyncio.create_subprocess_shell(
+        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return process.returncode or 0, maybe_truncate(stdout.decode()), maybe_truncate(stderr.decode())
+
+
+async def _measure(name: str, size: int, runner):
+    tracemalloc.start()
+    start = time.perf_counter()
+    _, stdout, _ = await runner(f"yes 0123456789abcdef | head -c {size * 2**20}")
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(stdout) < 2 * MAX_RESPONSE_LEN
+    print(f"{name:>12} {size:>3} MB output: {elapsed * 1000:7.0f} ms, peak {peak / 2**20:7.1f} MB")
+
+
+async def main():
+    for size in OUTPUT_SIZES_MB:
+        await _measure("communicate", size, _communicate)
+        await _measure("run", size, run)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Benchmark: per-frame screenshot latency for each screen backend.
+
+Times capture, scale and encode separately for every backend that works on this
+machine (synthetic always does; quartz and screencapture need macOS, imagegrab an
+X display such as Xvfb). For comparison, "file round trip" runs the synthetic
+frames through the old pipeline's disk steps: save the capture as a PNG in
+/tmp/outputs, open it to scale it, save it again and read it back. On macOS the
+old pipeline also spawned screencapture and sips for every frame.
+
+    python -m benchmarks.screen_capture
+    DISPLAY=:99 python -m benchmarks.screen_capture   # with Xvfb :99 running
+"""
+
+import base64
+import statistics
+import time
+import uuid
+from pathlib import Path
+
+from PIL import Image
+
+from tools.base import ToolError
+from tools.computer import SCALE_DESTINATION
+from tools.encoder import ImageEncoding, encode_image
+from tools.screen import SCREEN_BACKENDS, SyntheticBackend, scale_frame
+
+FRAMES = 20
+OUTPUT_DIR = Path("/tmp/outputs")
+SIZE = (SCALE_DESTINATION["width"], SCALE_DESTINATION["height"])
+
+
+def _in_memory(backend) -> tuple[float, float]:
+    start = time.perf_counter()
+    image = backend.capture()
+    captured = time.perf_counter()
+    base64.b64encode(encode_image(scale_frame(image, SIZE), ImageEncoding(format="png")).data).decode()
+    return captured - start, time.perf_counter() - captured
+
+
+def _file_round_trip(backend) -> tuple[float, float]:
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    path = OUTPUT_DIR / f"screenshot_{uuid.uuid4().hex}.png"
+    start = time.perf_counter()
+    backend.capture().save(path)
+    captured = time.perf_counter()
+    with Image.open(path) as image:
+        image.resize(SIZE, Image.Resampling.BILINEAR).save(path)
+    base64.b64encode(path.read_bytes()).decode()
+    path.unlink()
+    return captured - start, time.perf_counter() - captured
+
+
+def _report(name: str, timings: list[tuple[float, float]]):
+    capture = [c * 1000 for c, _ in timings]
+    encode = [e * 1000 for _, e in timings]
+    total = sorted(c + e for c, e in zip(capture, encode))
+    print(
+        f"{name:>18}: capture {statistics.median(capture):7.1f} ms | "
+        f"scale+encode {statistics.median(encode):7.1f} ms | "
+        f"total p50 {statistics.median(total):7.1f} ms, "
+        f"p95 {total[int(len(total) * 0.95) - 1]:7.1f} ms"
+    )
+
+
+def main():
+    for name, backend_class in SCREEN_BACKENDS.items():
+        try:
+            backend = backend_class()
+            backend.capture()  # warm up, and find out if it works here
+        except (ToolError, OSError, ImportError) as e:
+            print(f"{name:>18}: unavailable ({e.__class__.__name__}: {e})")
+            continue
+        _report(name, [_in_memory(backend) for _ in range(FRAMES)])
+
+    backend = SyntheticBackend()
+    _report("file round trip", [_file_round_trip(backend) for _ in range(FRAMES)])
+
+
+if __name__ == "__main__":
+    main()
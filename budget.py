@@ -0,0 +1,132 @@
+"""
+Pre-flight estimates of the size of a Messages API request.
+
+Nothing here calls the API: text is estimated from its length and images from
+their pixel count, using the same width * height / 750 rule the API uses to bill
+images. The estimates are meant for keeping requests under a budget, not billing.
+"""
+
+import base64
+import binascii
+import io
+import json
+import weakref
+from dataclasses import dataclass
+from typing import Any
+
+from PIL import Image
+
+from tools.base import ImageData, base64_length
+
+CHARS_PER_TOKEN = 3.5
+PIXELS_PER_IMAGE_TOKEN = 750
+# the API downscales images whose long edge is larger than this before billing them
+MAX_IMAGE_LONG_EDGE = 1568
+# base64 characters decoded when looking for a JPEG's frame header
+JPEG_HEADER_CHARS = 8192
+
+
+@dataclass(frozen=True)
+class RequestEstimate:
+    """Estimated size of a request"""
+
+    tokens: int
+    bytes: int
+
+    def __add__(self, other: "RequestEstimate") -> "RequestEstimate":
+        return RequestEstimate(tokens=self.tokens + other.tokens, bytes=self.bytes + other.bytes)
+
+    def __sub__(self, other: "RequestEstimate") -> "RequestEstimate":
+        return RequestEstimate(tokens=self.tokens - other.tokens, bytes=self.bytes - other.bytes)
+
+
+NOTHING = RequestEstimate(tokens=0, bytes=0)
+# images held as ImageData are estimated once, so their headers are read once
+_image_estimates: "weakref.WeakKeyDictionary[ImageData, RequestEstimate]" = weakref.WeakKeyDictionary()
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Estimate the number of tokens in a piece of text from its length."""
+    return round(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimate the tokens billed for an image of the given size."""
+    scale = min(1.0, MAX_IMAGE_LONG_EDGE / max(width, height, 1))
+    return round(width * scale * height * scale / PIXELS_PER_IMAGE_TOKEN)
+
+
+def image_dimensions(image: str | ImageData) -> tuple[int, int]:
+    """
+    Read the width and height of a PNG, JPEG or WebP, either raw or base64,
+    decoding as little of it as possible.
+    """
+    if isinstance(image, ImageData):
+        head = image.data[:24]
+        chunks = (image.data,)
+    else:
+        head = base64.b64decode(image[:32])
+        chunks = (image[:JPEG_HEADER_CHARS], image)
+    # a PNG's IHDR chunk, which holds the size, always starts at byte 16
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+
+    for data in chunks:
+        try:
+            raw = data if isinstance(data, bytes) else base64.b64decode(data)
+            with Image.open(io.BytesIO(raw)) as decoded:
+                return decoded.size
+        except (OSError, binascii.Error):
+            continue
+    raise ValueError("Unrecognised image data")
+
+
+def estimate_image(data: str | ImageData) -> RequestEstimate:
+    """Estimate the tokens and body bytes of an image block's data."""
+    if isinstance(data, ImageData) and data in _image_estimates:
+        return _image_estimates[data]
+    estimate = RequestEstimate(tokens=estimate_image_tokens(*image_dimensions(data)), bytes=base64_length(data))
+    if isinstance(data, ImageData):
+        _image_estimates[data] = estimate
+    return estimate
+
+
+def _estimate_text(text: str) -> RequestEstimate:
+    return RequestEstimate(tokens=estimate_text_tokens(text), bytes=len(text))
+
+
+def _estimate_block(block: Any) -> RequestEstimate:
+    if not isinstance(block, dict):
+        # content blocks returned by the API are models, not params
+        block = dict(block)
+    if block["type"] == "text":
+        return _estimate_text(block["text"])
+    if block["type"] == "tool_use":
+        return _estimate_text(json.dumps(block["input"]))
+    if block["type"] == "tool_result":
+        content = block.get("content", "")
+        if isinstance(content, str):
+            return _estimate_text(content)
+        return sum(map(_estimate_block, content), NOTHING)
+    if block["type"] == "image":
+        return estimate_image(block["source"]["data"])
+    return NOTHING
+
+
+def estimate_message(message: Any) -> RequestEstimate:
+    """Estimate the input tokens and body bytes one message adds to a request."""
+    if isinstance(message["content"], str):
+        return _estimate_text(message["content"])
+    return sum(map(_estimate_block, message["content"]), NOTHING)
+
+
+def estimate_request(params: dict[str, Any]) -> RequestEstimate:
+    """Estimate the input tokens and body size of a request built from params."""
+    system = params.get("system", "")
+    estimate = (
+        _estimate_text(system)
+        if isinstance(system, str)
+        else sum((_estimate_text(block["text"]) for block in system), NOTHING)
+    )
+    estimate += _estimate_text(json.dumps(params.get("tools", [])))
+    return sum(map(estimate_message, params["messages"]), estimate)
@@ -0,0 +1,126 @@
+"""
+Long-lived API clients shared across turns, agent instances and providers.
+
+Building a client per request or per agent means a new connection, with its DNS
+lookup and TCP and TLS handshakes, on every turn. Instead there is one client per
+provider and API key, each on an HTTP/2 connection pool that outlives the agent.
+The clients don't retry on their own: their requests go through the provider and
+key's shared RequestScheduler, which retries with the rate limits in view.
+"""
+
+import asyncio
+import weakref
+from dataclasses import dataclass
+from enum import StrEnum
+
+import httpx
+from anthropic import (
+    AsyncAnthropic,
+    AsyncAnthropicBedrock,
+    AsyncAnthropicVertex,
+    DefaultAsyncHttpxClient,
+)
+
+from scheduler import RequestScheduler
+
+
+class APIProvider(StrEnum):
+    ANTHROPIC = "anthropic"
+    BEDROCK = "bedrock"
+    VERTEX = "vertex"
+
+
+AsyncClient = AsyncAnthropic | AsyncAnthropicBedrock | AsyncAnthropicVertex
+
+# keep idle connections around for longer than a typical run of tool calls
+CONNECTION_LIMITS = httpx.Limits(
+    max_connections=100, max_keepalive_connections=20, keepalive_expiry=120.0
+)
+
+WARM_TIMEOUT = 10.0  # seconds
+
+
+@dataclass
+class _PoolEntry:
+    client: AsyncClient
+    http_client: httpx.AsyncClient
+    scheduler: RequestScheduler
+
+
+_PoolKey = tuple[APIProvider, str | None]
+
+# httpx connections belong to the event loop that opened them, so clients are
+# pooled per loop; streamlit, for one, runs every rerun in a fresh loop
+_pools: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[_PoolKey, _PoolEntry]
+] = weakref.WeakKeyDictionary()
+_unbound_pool: dict[_PoolKey, _PoolEntry] = {}
+_warming: set[httpx.AsyncClient] = set()
+
+
+def _pool() -> dict[_PoolKey, _PoolEntry]:
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _unbound_pool
+    return _pools.setdefault(loop, {})
+
+
+def _entry(provider: APIProvider, api_key: str | None) -> _PoolEntry:
+    key = (APIProvider(provider), api_key if provider == APIProvider.ANTHROPIC else None)
+    pool = _pool()
+    if key in pool:
+        return pool[key]
+
+    http_client = DefaultAsyncHttpxClient(http2=True, limits=CONNECTION_LIMITS)
+    if provider == APIProvider.ANTHROPIC:
+        client = AsyncAnthropic(api_key=api_key, http_client=http_client, max_retries=0)
+    elif provider == APIProvider.VERTEX:
+        client = AsyncAnthropicVertex(http_client=http_client, max_retries=0)
+    elif provider == APIProvider.BEDROCK:
+        client = AsyncAnthropicBedrock(http_client=http_client, max_retries=0)
+    else:
+        raise ValueError(f"Unsupported API provider: {provider}")
+    pool[key] = _PoolEntry(client, http_client, RequestScheduler())
+    return pool[key]
+
+
+def get_client(provider: APIProvider, api_key: str | None = None) -> AsyncClient:
+    """Return the shared client for a provider and API key, creating it on first use."""
+    return _entry(provider, api_key).client
+
+
+def get_scheduler(provider: APIProvider, api_key: str | None = None) -> RequestScheduler:
+    """Return the scheduler that every request with this provider and API key goes through."""
+    return _entry(provider, api_key).scheduler
+
+
+async def warm_connection(client: AsyncClient) -> None:
+    """
+    Make sure the client's pool holds an open connection to its API host, so the
+    next request does not pay for a handshake. Meant to run while tools execute.
+    """
+    for entry in _pool().values():
+        if entry.client is client:
+            http_client = entry.http_client
+            break
+    else:
+        return
+    if http_client in _warming:
+        return
+    _warming.add(http_client)
+    try:
+        # any response will do, the point is the connection it leaves in the pool
+        await http_client.head(str(client.base_url), timeout=WARM_TIMEOUT)
+    except httpx.HTTPError:
+        pass
+    finally:
+        _warming.discard(http_client)
+
+
+async def close_clients() -> None:
+    """Close the pooled clients of the running event loop."""
+    pool = _pool()
+    for entry in pool.values():
+        await entry.http_client.aclose()
+    pool.clear()
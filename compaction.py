@@ -0,0 +1,111 @@
+"""
+Compaction of long agent histories: the oldest turns are replaced with a short
+summary while the most recent turns are kept as they are.
+"""
+
+import json
+from typing import Any
+
+from anthropic.types.beta import BetaMessageParam, BetaTextBlockParam
+
+SUMMARY_TAG = "summary_of_earlier_turns"
+MAX_SUMMARY_CHARS = 6000
+MAX_LINE_CHARS = 300
+
+SUMMARY_PROMPT = """Below is a log of the earlier part of a computer use session: what the assistant said, the tool calls it made and what they returned.
+Write a concise summary of it for the assistant to continue the task from. Keep what was achieved, what is still open, and anything learned about the screen layout or what did not work.
+Reply with the summary only.
+
+<log>
+{log}
+</log>"""
+
+
+def find_compaction_cut(messages: list[BetaMessageParam], keep_turns: int) -> int | None:
+    """
+    Find the index of the first message to keep so that the last `keep_turns`
+    assistant turns stay untouched. The cut is always at an assistant message, so
+    every tool_use it keeps has its tool_result after it and no kept tool_result
+    loses its tool_use. Returns None if there is nothing old enough to compact.
+    """
+    seen = 0
+    for i in range(len(messages) - 1, 0, -1):
+        if messages[i]["role"] == "assistant":
+            seen += 1
+            if seen == keep_turns:
+                # index 0 holds the task (or an earlier summary), so a cut at 1
+                # would have nothing to compact
+                return i if i > 1 else None
+    return None
+
+
+def _shorten(text: str, limit: int = MAX_LINE_CHARS) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def _block_dict(block: Any) -> dict[str, Any]:
+    # content blocks returned by the API are models, not params
+    return block if isinstance(block, dict) else dict(block)
+
+
+def _tool_result_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return " ".join(
+        item["text"] if item["type"] == "text" else f"[{item['type']}]"
+        for item in map(_block_dict, content)
+    )
+
+
+def extractive_summary(messages: list[BetaMessageParam], previous: str = "") -> str:
+    """
+    Summarise turns locally, one line per text block, tool call and tool result,
+    after the summary of any earlier compaction.
+    If the result is too long, the oldest lines are dropped.
+    """
+    lines: list[str] = [previous] if previous else []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            lines.append(f"{message['role']}: {_shorten(content)}")
+            continue
+        for block in map(_block_dict, content):
+            if block["type"] == "text":
+                lines.append(f"{message['role']}: {_shorten(block['text'])}")
+            elif block["type"] == "tool_use":
+                lines.append(f"tool call {block['name']}: {_shorten(json.dumps(block['input']))}")
+            elif block["type"] == "tool_result":
+                status = "tool error" if block.get("is_error") else "tool result"
+                lines.append(f"{status}: {_shorten(_tool_result_text(block.get('content', '')))}")
+
+    summary = "\n".join(lines)
+    if len(summary) > MAX_SUMMARY_CHARS:
+        summary = "...\n" + summary[-MAX_SUMMARY_CHARS:].split("\n", 1)[-1]
+    return summary
+
+
+def split_summary(message: BetaMessageParam) -> tuple[list[Any], str]:
+    """
+    Split the first message of a history into its task blocks and the text of a
+    summary left there by an earlier compaction, if any. The task blocks come
+    without cache breakpoints, which belonged to the message as it was.
+    """
+    content = message["content"]
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}], ""
+    task = []
+    summary = ""
+    for block in content:
+        text = _block_dict(block).get("text", "")
+        if text.startswith(f"<{SUMMARY_TAG}>"):
+            summary = text.removeprefix(f"<{SUMMARY_TAG}>").removesuffix(f"</{SUMMARY_TAG}>").strip()
+        elif isinstance(block, dict):
+            task.append({key: value for key, value in block.items() if key != "cache_control"})
+        else:
+            task.append(block)
+    return task, summary
+
+
+def summary_block(summary: str) -> BetaTextBlockParam:
+    return {"type": "text", "text": f"<{SUMMARY_TAG}>\n{summary}\n</{SUMMARY_TAG}>"}
@@ -0,0 +1,41 @@
+"""
+Retention schedule for the screenshots kept in an agent's message history.
+"""
+
+import io
+from dataclasses import dataclass
+
+from PIL import Image
+
+from tools.base import ImageData, image_bytes
+
+
+@dataclass(frozen=True, kw_only=True)
+class ImageRetentionPolicy:
+    """
+    How many screenshots to keep in the history, and at what quality.
+
+    The `full` most recent images are sent unchanged, the next `thumbnails` are
+    replaced with small grayscale JPEGs, and anything older is dropped. Images move
+    between tiers in chunks of `chunk_size` so the prompt prefix (and with it the
+    prompt cache) only changes every few turns.
+    """
+
+    full: int
+    thumbnails: int = 0
+    thumbnail_scale: float = 0.5
+    thumbnail_quality: int = 40
+    chunk_size: int = 10
+
+
+def make_thumbnail(data: str | ImageData, scale: float, quality: int) -> ImageData:
+    """Re-encode an image block's data as a downscaled grayscale JPEG."""
+    with Image.open(io.BytesIO(image_bytes(data))) as image:
+        thumbnail = image.convert("L")
+    thumbnail = thumbnail.resize(
+        (max(1, round(thumbnail.width * scale)), max(1, round(thumbnail.height * scale))),
+        Image.Resampling.BILINEAR,
+    )
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return ImageData(buffer.getvalue(), "image/jpeg")
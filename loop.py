@@ -1,36 +1,64 @@
 """
 Core computer use agent loop that can work with messages from any source.
 """
+import asyncio
 import dotenv
+import json
 import os
 dotenv.load_dotenv()
 import platform
-from collections.abc import Callable
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
 from datetime import datetime
-from enum import StrEnum
 from typing import Any, Protocol, cast
 import talk
-from anthropic import Anthropic, AnthropicBedrock, AnthropicVertex, APIResponse
+from anthropic import AsyncStream, APIError, APIResponse
 from anthropic.types import ToolResultBlockParam
 from anthropic.types.beta import (
+    BetaCacheControlEphemeralParam,
     BetaContentBlock,
     BetaContentBlockParam,
     BetaImageBlockParam,
     BetaMessage,
     BetaMessageParam,
+    BetaRawMessageStreamEvent,
+    BetaTextBlock,
     BetaTextBlockParam,
     BetaToolResultBlockParam,
     BetaToolUseBlock,
+    BetaUsage,
 )
 
+from budget import (
+    CHARS_PER_TOKEN,
+    NOTHING,
+    RequestEstimate,
+    estimate_image,
+    estimate_message,
+    estimate_request,
+)
+from client_pool import APIProvider, get_client, get_scheduler, warm_connection
+from compaction import (
+    MAX_SUMMARY_CHARS,
+    SUMMARY_PROMPT,
+    extractive_summary,
+    find_compaction_cut,
+    split_summary,
+    summary_block,
+)
+from image_retention import ImageRetentionPolicy, make_thumbnail
 from tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
+from tools.base import base64_length, encode_images
+from tools.progress import OutputCoalescer
 
 BETA_FLAG = "computer-use-2024-10-22"
+PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
 
-class APIProvider(StrEnum):
-    ANTHROPIC = "anthropic"
-    BEDROCK = "bedrock"
-    VERTEX = "vertex"
+# the API allows 4 cache breakpoints per request: one goes on the system prompt,
+# one on the tool list and the rest on the most recent user turns
+CACHED_USER_TURNS = 2
 
 PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
     APIProvider.ANTHROPIC: "claude-3-5-sonnet-20241022",
@@ -95,15 +123,47 @@ class MessageHandler(Protocol):
     async def handle_tool_output(self, result: ToolResult, tool_id: str) -> None:
         """Handle output from tools"""
         ...
+
+    async def handle_tool_progress(self, output: str, tool_id: str) -> None:
+        """
+        Handle output from a tool that is still running (bash), batched up and
+        delivered at most a few times a second. handle_tool_output still gets
+        the whole result at the end.
+        """
+        ...
     
     async def handle_model_output(self, content: BetaContentBlock) -> None:
-        """Handle output from the model"""
+        """
+        Handle output from the model.
+        In streaming mode text arrives as a series of partial text blocks holding
+        only the newly generated text, and tool_use blocks arrive once complete.
+        """
+        ...
+
+    async def handle_model_output_complete(self, content: BetaContentBlock) -> None:
+        """
+        Handle a content block once the model has finished it, with all of its
+        text. Called once per block in both modes, after handle_model_output.
+        """
         ...
     
     async def handle_api_response(self, response: APIResponse[BetaMessage]) -> None:
         """Handle raw API responses"""
         ...
 
+@dataclass
+class TurnStats:
+    """Token usage and timing of a single model request"""
+    input_tokens: int
+    output_tokens: int
+    cache_creation_input_tokens: int
+    cache_read_input_tokens: int
+    latency: float  # seconds until the full response was received
+    time_to_first_token: float | None = None  # seconds, streaming mode only
+    image_bytes_saved: int = 0  # base64 bytes removed from the history by image retention
+    estimated_input_tokens: int | None = None  # pre-flight estimate from the budgeter
+    image_dedup_ratio: float | None = None  # screenshots stored per distinct screenshot, so far
+
 class ComputerUseAgent:
     """Main agent class for handling computer use interactions"""
     
@@ -115,6 +175,15 @@ class ComputerUseAgent:
         system_prompt_suffix: str = "",
         max_tokens: int = 4096,
         only_n_most_recent_images: int | None = None,
+        image_retention: ImageRetentionPolicy | None = None,
+        stream: bool = False,
+        prompt_caching: bool = False,
+        max_input_tokens: int | None = None,
+        max_request_bytes: int | None = None,
+        compact_after_tokens: int | None = None,
+        compaction_keep_turns: int = 10,
+        compaction_model: str | None = None,
+        tool_collection: ToolCollection | None = None,
     ):
         self.api_provider = api_provider
         self.api_key = api_key
@@ -122,22 +191,48 @@ class ComputerUseAgent:
         self.system_prompt = f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}"
         self.max_tokens = max_tokens
         self.only_n_most_recent_images = only_n_most_recent_images
+        if image_retention is None and only_n_most_recent_images:
+            image_retention = ImageRetentionPolicy(full=only_n_most_recent_images)
+        self.image_retention = image_retention
+        self.stream = stream
+        self.prompt_caching = prompt_caching
+        self.max_input_tokens = max_input_tokens
+        self.max_request_bytes = max_request_bytes
+        self.compact_after_tokens = compact_after_tokens
+        self.compaction_keep_turns = compaction_keep_turns
+        self.compaction_model = compaction_model
+        self.turn_stats: list[TurnStats] = []
+
+        # strategies the budgeter runs, in order, until a request fits; each one
+        # shrinks the history a little and returns False once it has nothing left
+        self._budget_strategies: list[Callable[[list[BetaMessageParam]], Awaitable[bool]]] = [
+            self._drop_oldest_image,
+            self._compact,
+        ]
+
+        # (tool_result content list, image block) for every full resolution and
+        # every thumbnail image in the history, oldest first, so pruning never has
+        # to walk the whole history
+        self._image_index: deque[tuple[list[Any], BetaImageBlockParam]] = deque()
+        self._thumbnail_index: deque[tuple[list[Any], BetaImageBlockParam]] = deque()
+        self._indexed_messages: list[BetaMessageParam] | None = None
+        # running estimate of the messages of the indexed history up to
+        # _estimated_messages, kept current as images leave it, so a turn only
+        # estimates the messages added since the last one
+        self._history_estimate = NOTHING
+        self._estimated_messages = 0
         
-        self.tool_collection = ToolCollection(
+        self.tool_collection = tool_collection or ToolCollection(
             ComputerTool(),
             BashTool(),
             EditTool(),
         )
         
-        # Initialize the appropriate client
-        if api_provider == APIProvider.ANTHROPIC:
-            self.client = Anthropic(api_key=api_key)
-        elif api_provider == APIProvider.VERTEX:
-            self.client = AnthropicVertex()
-        elif api_provider == APIProvider.BEDROCK:
-            self.client = AnthropicBedrock()
-        else:
-            raise ValueError(f"Unsupported API provider: {api_provider}")
+        # Use the shared client for this provider, so its connections outlive the agent
+        self.client = get_client(api_provider, api_key)
+        # shared with every other agent using the same key, so they pace each other
+        self.scheduler = get_scheduler(api_provider, api_key)
+        self._warm_task: asyncio.Task[None] | None = None
 
     async def process_messages(
         self,
@@ -147,6 +242,12 @@ class ComputerUseAgent:
         """
         Process a list of messages through the computer use agent loop.
         Returns the updated message history.
+
+        All API calls are awaited, so the event loop stays free while a request is in
+        flight. If the task is cancelled the history is left valid to resume from:
+        any tool_use blocks already in it get a matching (cancelled) tool_result.
+        Rate limited and overloaded requests are held and retried by the scheduler,
+        so the turn being built is not lost to a 429 or 529.
         """
         first = True
         while True:  # Continue looping until no more tool calls are needed
@@ -155,40 +256,72 @@ class ComputerUseAgent:
                 pass
                 # await asyncio.sleep(5)
             first = False
-            if self.only_n_most_recent_images:
-                self._maybe_filter_to_n_most_recent_images(messages)
-
-            # Call the API
-            raw_response = self.client.beta.messages.with_raw_response.create(
-                max_tokens=self.max_tokens,
-                messages=messages,
-                model=self.model,
-                system=self.system_prompt,
-                tools=self.tool_collection.to_params(),
-                betas=[BETA_FLAG],
-            )
+            image_bytes_saved = 0
+            if self.image_retention:
+                image_bytes_saved = await self._apply_image_retention(messages)
+            if self.compact_after_tokens is not None:
+                if self._estimate(messages).tokens > self.compact_after_tokens:
+                    # compact well below the threshold, so it is not crossed again next turn
+                    await self._compact(messages, target_tokens=self.compact_after_tokens // 2)
+            if self.prompt_caching:
+                self._inject_prompt_caching(messages)
+            estimate = await self._enforce_budget(messages)
+
+            if self.stream:
+                started = time.perf_counter()
+                response, tool_result_content, time_to_first_token = await self._stream_response(
+                    messages, message_handler, estimate
+                )
+                self._record_turn_stats(
+                    response.usage,
+                    time.perf_counter() - started,
+                    time_to_first_token,
+                    image_bytes_saved,
+                    estimate,
+                )
+                messages.append({
+                    "role": "assistant",
+                    "content": cast(list[BetaContentBlockParam], response.content),
+                })
+            else:
+                # Call the API
+                started = time.perf_counter()
+                params = self._request_params(messages)
+                raw_response = await self.scheduler.call(
+                    lambda: self.client.beta.messages.with_raw_response.create(**params),
+                    estimate.tokens,
+                )
 
-            await message_handler.handle_api_response(cast(APIResponse[BetaMessage], raw_response))
-            response = raw_response.parse()
-
-            messages.append({
-                "role": "assistant",
-                "content": cast(list[BetaContentBlockParam], response.content),
-            })
-
-            tool_result_content: list[BetaToolResultBlockParam] = []
-            for content_block in cast(list[BetaContentBlock], response.content):
-                await message_handler.handle_model_output(content_block)
-                
-                if content_block.type == "tool_use":
-                    result = await self.tool_collection.run(
-                        name=content_block.name,
-                        tool_input=cast(dict[str, Any], content_block.input),
-                    )
-                    tool_result_content.append(
-                        self._make_api_tool_result(result, content_block.id)
-                    )
-                    await message_handler.handle_tool_output(result, content_block.id)
+                await message_handler.handle_api_response(cast(APIResponse[BetaMessage], raw_response))
+                response = raw_response.parse()
+                self._record_turn_stats(
+                    response.usage,
+                    time.perf_counter() - started,
+                    image_bytes_saved=image_bytes_saved,
+                    estimate=estimate,
+                )
+
+                messages.append({
+                    "role": "assistant",
+                    "content": cast(list[BetaContentBlockParam], response.content),
+                })
+
+                tool_result_content = []
+                try:
+                    for content_block in cast(list[BetaContentBlock], response.content):
+                        await message_handler.handle_model_output(content_block)
+                        await message_handler.handle_model_output_complete(content_block)
+
+                        if content_block.type == "tool_use":
+                            tool_result_content.append(
+                                await self._run_tool(content_block, message_handler)
+                            )
+                except asyncio.CancelledError:
+                    messages.append({
+                        "content": self._close_cancelled_tool_uses(response, tool_result_content),
+                        "role": "user",
+                    })
+                    raise
 
             if tool_result_content:
                 messages.append({"content": tool_result_content, "role": "user"})
@@ -196,45 +329,441 @@ class ComputerUseAgent:
                 # If no tool calls were made, we're done with this interaction
                 return messages
 
-    def _maybe_filter_to_n_most_recent_images(
+    async def close(self):
+        """Release the tools' resources, such as the computer tool's input thread. Call when done with the agent."""
+        await self.tool_collection.close()
+
+    def _request_params(self, messages: list[BetaMessageParam]) -> dict[str, Any]:
+        """Build the keyword arguments for a Messages API request"""
+        if not self.prompt_caching:
+            return {
+                "max_tokens": self.max_tokens,
+                "messages": encode_images(messages),
+                "model": self.model,
+                "system": self.system_prompt,
+                "tools": self.tool_collection.to_params(),
+                "betas": [BETA_FLAG],
+            }
+
+        # the system prompt and tools never change within a session, so a breakpoint
+        # after each of them lets every turn reuse that prefix from the cache
+        cache_control = BetaCacheControlEphemeralParam({"type": "ephemeral"})
+        tools = self.tool_collection.to_params()
+        tools[-1] = {**tools[-1], "cache_control": cache_control}
+        return {
+            "max_tokens": self.max_tokens,
+            "messages": encode_images(messages),
+            "model": self.model,
+            "system": [
+                {"type": "text", "text": self.system_prompt, "cache_control": cache_control}
+            ],
+            "tools": tools,
+            "betas": [BETA_FLAG, PROMPT_CACHING_BETA_FLAG],
+        }
+
+    def _inject_prompt_caching(self, messages: list[BetaMessageParam]):
+        """
+        Set cache breakpoints on the CACHED_USER_TURNS most recent user turns and
+        remove the ones left behind as the window moves forward.
+        """
+        breakpoints_remaining = CACHED_USER_TURNS
+        for message in reversed(messages):
+            if message["role"] != "user" or not isinstance(content := message["content"], list):
+                continue
+            if not content or not isinstance(content[-1], dict):
+                continue
+            if breakpoints_remaining:
+                breakpoints_remaining -= 1
+                content[-1]["cache_control"] = BetaCacheControlEphemeralParam({"type": "ephemeral"})
+            elif content[-1].pop("cache_control", None) is None:
+                # stale breakpoints are removed as the window moves, so everything
+                # older than the first turn without one is already clean
+                break
+
+    async def _enforce_budget(self, messages: list[BetaMessageParam]) -> RequestEstimate:
+        """
+        Estimate the next request and, if it is over max_input_tokens or
+        max_request_bytes, run the budget strategies until it fits.
+        Returns the estimate of the request that will be sent.
+        """
+        estimate = self._estimate(messages)
+        while self._over_budget(estimate):
+            for strategy in self._budget_strategies:
+                if await strategy(messages):
+                    break
+            else:
+                print(
+                    f"Request is over budget ({estimate.tokens} tokens, {estimate.bytes} bytes) "
+                    "and cannot be reduced further"
+                )
+                break
+            estimate = self._estimate(messages)
+        return estimate
+
+    def _estimate(self, messages: list[BetaMessageParam]) -> RequestEstimate:
+        """Estimate the next request: the system prompt and tools, plus the running history estimate"""
+        self._update_history_estimate(messages)
+        return estimate_request(self._request_params([])) + self._history_estimate
+
+    def _update_history_estimate(self, messages: list[BetaMessageParam]):
+        """Bring the running history estimate up to date with messages added since it was last updated"""
+        if messages is not self._indexed_messages:
+            self._rebuild_image_index(messages)
+        if len(messages) < self._estimated_messages:  # shortened by someone else
+            self._history_estimate, self._estimated_messages = NOTHING, 0
+        for message in messages[self._estimated_messages :]:
+            self._history_estimate += estimate_message(message)
+        self._estimated_messages = len(messages)
+
+    def _over_budget(self, estimate: RequestEstimate) -> bool:
+        return (self.max_input_tokens is not None and estimate.tokens > self.max_input_tokens) or (
+            self.max_request_bytes is not None and estimate.bytes > self.max_request_bytes
+        )
+
+    async def _drop_oldest_image(self, messages: list[BetaMessageParam]) -> bool:
+        """Budget strategy: remove the oldest image in the history, thumbnails first"""
+        self._update_history_estimate(messages)
+        for index in (self._thumbnail_index, self._image_index):
+            if index:
+                content, image = index.popleft()
+                self._remove_image(content, image)
+                self._history_estimate -= estimate_image(image["source"]["data"])
+                self._forget_images([image["source"]["data"]])
+                return True
+        return False
+
+    async def _compact(self, messages: list[BetaMessageParam], target_tokens: int | None = None) -> bool:
+        """
+        Replace the turns before the last compaction_keep_turns assistant turns with a
+        summary, kept in the first message after the original task. Works in place.
+        If target_tokens is given, fewer turns are kept, down to the last one, until the
+        next request is estimated to fit in it.
+        Also a budget strategy: returns False if there is nothing left to compact.
+        """
+        cut = find_compaction_cut(messages, self.compaction_keep_turns)
+        if target_tokens is not None:
+            cut = self._low_water_cut(messages, cut or 1, target_tokens)
+        if cut is None:
+            return False
+
+        task, previous_summary = split_summary(messages[0])
+        compacted = messages[1:cut]
+        summary = extractive_summary(compacted, previous_summary)
+        if self.compaction_model:
+            summary = await self._summarize_with_model(summary)
+        messages[:cut] = [{"role": "user", "content": [*task, summary_block(summary)]}]
+        # estimated again from scratch on the next turn
+        self._history_estimate, self._estimated_messages = NOTHING, 0
+
+        # forget the images that went with the compacted turns
+        self._forget_images([
+            item["source"]["data"]
+            for message in compacted
+            if isinstance(message["content"], list)
+            for block in message["content"]
+            if isinstance(block, dict) and block.get("type") == "tool_result"
+            and isinstance(block.get("content"), list)
+            for item in block["content"]
+            if isinstance(item, dict) and item.get("type") == "image"
+        ])
+        if messages is self._indexed_messages:
+            removed = {
+                id(block.get("content"))
+                for message in compacted
+                if isinstance(message["content"], list)
+                for block in message["content"]
+                if isinstance(block, dict) and block.get("type") == "tool_result"
+            }
+            for index in (self._image_index, self._thumbnail_index):
+                kept = [entry for entry in index if id(entry[0]) not in removed]
+                index.clear()
+                index.extend(kept)
+
+        print(f"Compacted {len(compacted)} messages into a {len(summary)} character summary")
+        return True
+
+    def _low_water_cut(self, messages: list[BetaMessageParam], start: int, target_tokens: int) -> int | None:
+        """
+        Find the first assistant message from `start` on that makes a compaction cut
+        keeping what is estimated to fit in target_tokens, or the last one if none
+        does. Returns None if there is no assistant message to cut at.
+        """
+        # the system prompt, tools and task, plus the longest summary there can be
+        fixed = (
+            estimate_request(self._request_params([])).tokens
+            + estimate_message(messages[0]).tokens
+            + round(MAX_SUMMARY_CHARS / CHARS_PER_TOKEN)
+        )
+        tail = [estimate_message(message).tokens for message in messages[start:]]
+        kept = sum(tail)
+        cut = None
+        # as in find_compaction_cut, a cut at 1 would have nothing to compact
+        for i, tokens in enumerate(tail, start=start):
+            if messages[i]["role"] == "assistant" and i > 1:
+                cut = i
+                if fixed + kept <= target_tokens:
+                    break
+            kept -= tokens
+        return cut
+
+    async def _summarize_with_model(self, log: str) -> str:
+        """Condense an extractive summary with a cheap model, keeping the log if that fails"""
+        params = {
+            "max_tokens": 1024,
+            "messages": [{"role": "user", "content": SUMMARY_PROMPT.format(log=log)}],
+            "model": self.compaction_model,
+            "betas": [BETA_FLAG],
+        }
+        try:
+            # paced with the agent's other requests, as it shares their rate limits
+            raw_response = await self.scheduler.call(
+                lambda: self.client.beta.messages.with_raw_response.create(**params),
+                estimate_request(params).tokens,
+            )
+        except APIError as e:
+            print(f"Error summarizing history, keeping the extractive summary: {e}")
+            return log
+        response = raw_response.parse()
+        return "\n".join(block.text for block in response.content if block.type == "text") or log
+
+    def _record_turn_stats(
         self,
-        messages: list[BetaMessageParam],
-        min_removal_threshold: int = 10,
+        usage: BetaUsage,
+        latency: float,
+        time_to_first_token: float | None = None,
+        image_bytes_saved: int = 0,
+        estimate: RequestEstimate | None = None,
     ):
-        """Filter messages to keep only N most recent images"""
-        tool_result_blocks = cast(
-            list[ToolResultBlockParam],
-            [
-                item
-                for message in messages
-                for item in (
-                    message["content"] if isinstance(message["content"], list) else []
-                )
-                if isinstance(item, dict) and item.get("type") == "tool_result"
-            ],
+        """Record the token usage of a response, including prompt cache reads and writes"""
+        images = getattr(self.tool_collection.tool_map.get("computer"), "images", None)
+        image_stats = images.stats() if images is not None else None
+        stats = TurnStats(
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            cache_creation_input_tokens=usage.cache_creation_input_tokens or 0,
+            cache_read_input_tokens=usage.cache_read_input_tokens or 0,
+            latency=latency,
+            time_to_first_token=time_to_first_token,
+            image_bytes_saved=image_bytes_saved,
+            estimated_input_tokens=estimate.tokens if estimate else None,
+            image_dedup_ratio=image_stats.dedup_ratio if image_stats and image_stats.images else None,
+        )
+        self.turn_stats.append(stats)
+        print(
+            f"Turn {len(self.turn_stats)}: "
+            + (f"~{stats.estimated_input_tokens} input tokens estimated, " if stats.estimated_input_tokens is not None else "")
+            + f"{stats.input_tokens + stats.cache_read_input_tokens + stats.cache_creation_input_tokens} input tokens used "
+            f"({stats.cache_read_input_tokens} cache read, {stats.cache_creation_input_tokens} cache write), "
+            f"{stats.output_tokens} output tokens in {stats.latency:.2f}s"
+            + (f", first token after {stats.time_to_first_token:.2f}s" if stats.time_to_first_token is not None else "")
+            + (f", {stats.image_bytes_saved} image bytes saved" if stats.image_bytes_saved else "")
+            + (f", {image_stats.live_images} images held ({stats.image_dedup_ratio:.2f}x dedup, "
+               f"{image_stats.bytes_in_memory} bytes in memory, {image_stats.bytes_on_disk} on disk)"
+               if stats.image_dedup_ratio is not None else "")
         )
 
-        total_images = sum(
-            1
-            for tool_result in tool_result_blocks
-            for content in tool_result.get("content", [])
-            if isinstance(content, dict) and content.get("type") == "image"
+    async def _run_tool(
+        self,
+        content_block: BetaToolUseBlock,
+        message_handler: MessageHandler,
+    ) -> BetaToolResultBlockParam:
+        """Run a single tool_use block and report its output"""
+        # keep a connection ready for the next request while the tool runs
+        if self._warm_task is None or self._warm_task.done():
+            self._warm_task = asyncio.create_task(warm_connection(self.client))
+        progress = OutputCoalescer(
+            lambda output: message_handler.handle_tool_progress(output, content_block.id)
         )
+        try:
+            result = await self.tool_collection.run(
+                name=content_block.name,
+                tool_input=cast(dict[str, Any], content_block.input),
+                on_output=progress,
+            )
+        finally:
+            await progress.close()
+        await message_handler.handle_tool_output(result, content_block.id)
+        return self._make_api_tool_result(result, content_block.id)
+
+    async def _stream_response(
+        self,
+        messages: list[BetaMessageParam],
+        message_handler: MessageHandler,
+        estimate: RequestEstimate,
+    ) -> tuple[BetaMessage, list[BetaToolResultBlockParam], float | None]:
+        """
+        Stream a model response, forwarding text deltas to the handler as they arrive
+        and running each tool_use block as soon as its input JSON is complete.
+        Returns the accumulated message, the results of the tools it called and the
+        time to the first content block.
 
-        images_to_remove = total_images - self.only_n_most_recent_images
+        Only opening the stream is retried: once events are flowing, text has been
+        shown and tools may have run, so an error mid-stream is raised.
+        """
+        started = time.perf_counter()
+        first_token_at: float | None = None
+        params = self._request_params(messages)
+        raw_response = await self.scheduler.call(
+            lambda: self.client.beta.messages.with_raw_response.create(**params, stream=True),
+            estimate.tokens,
+        )
+        await message_handler.handle_api_response(cast(APIResponse[BetaMessage], raw_response))
+
+        response: BetaMessage | None = None
+        partial_json: dict[int, str] = {}
+        tool_result_content: list[BetaToolResultBlockParam] = []
+        stream = cast(AsyncStream[BetaRawMessageStreamEvent], raw_response.parse())
+        try:
+            async for event in stream:
+                if event.type == "message_start":
+                    response = event.message
+                    response.content = []
+                    continue
+                if response is None:
+                    raise RuntimeError(f'Unexpected event order, got {event.type} before "message_start"')
+
+                if event.type == "content_block_start":
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    response.content.append(event.content_block)
+                elif event.type == "content_block_delta":
+                    if event.delta.type == "text_delta":
+                        cast(BetaTextBlock, response.content[event.index]).text += event.delta.text
+                        await message_handler.handle_model_output(
+                            BetaTextBlock(type="text", text=event.delta.text)
+                        )
+                    elif event.delta.type == "input_json_delta":
+                        partial_json[event.index] = partial_json.get(event.index, "") + event.delta.partial_json
+                elif event.type == "content_block_stop":
+                    content_block = response.content[event.index]
+                    if content_block.type == "tool_use":
+                        content_block.input = json.loads(partial_json.pop(event.index, "") or "{}")
+                        await message_handler.handle_model_output(content_block)
+                    await message_handler.handle_model_output_complete(content_block)
+                    if content_block.type == "tool_use":
+                        tool_result_content.append(
+                            await self._run_tool(content_block, message_handler)
+                        )
+                elif event.type == "message_delta":
+                    response.stop_reason = event.delta.stop_reason
+                    response.stop_sequence = event.delta.stop_sequence
+                    response.usage.output_tokens = event.usage.output_tokens
+        finally:
+            # closing the stream releases the connection if the task is cancelled
+            await stream.close()
+
+        if response is None:
+            raise RuntimeError("Stream ended before a message was started")
+        time_to_first_token = first_token_at - started if first_token_at is not None else None
+        return response, tool_result_content, time_to_first_token
+
+    def _close_cancelled_tool_uses(
+        self,
+        response: BetaMessage,
+        tool_result_content: list[BetaToolResultBlockParam],
+    ) -> list[BetaToolResultBlockParam]:
+        """Pad the results of a cancelled turn so every tool_use has a tool_result"""
+        finished = {result["tool_use_id"] for result in tool_result_content}
+        return tool_result_content + [
+            {
+                "type": "tool_result",
+                "content": "cancelled before the tool finished running",
+                "tool_use_id": content_block.id,
+                "is_error": True,
+            }
+            for content_block in response.content
+            if content_block.type == "tool_use" and content_block.id not in finished
+        ]
+
+    async def _apply_image_retention(self, messages: list[BetaMessageParam]) -> int:
+        """
+        Apply self.image_retention to the images in messages: degrade the oldest full
+        resolution images to thumbnails and drop the oldest thumbnails.
+        Images are looked up in the image indexes rather than by rescanning the
+        history, so each call costs O(images changed).
+        Returns the number of base64 bytes removed from the history.
+        """
+        policy = self.image_retention
+        # so the images changed below are all in messages it has counted
+        self._update_history_estimate(messages)
+
+        bytes_saved = 0
+        to_degrade = self._take_excess(self._image_index, policy.full, policy.chunk_size)
+        forgotten = [image["source"]["data"] for _, image in to_degrade]
+        if policy.thumbnails:
+            bytes_saved += sum(base64_length(image["source"]["data"]) for _, image in to_degrade)
+            thumbnails = await asyncio.to_thread(
+                lambda: [
+                    make_thumbnail(
+                        image["source"]["data"],
+                        policy.thumbnail_scale,
+                        policy.thumbnail_quality,
+                    )
+                    for _, image in to_degrade
+                ]
+            )
+            for (content, image), thumbnail in zip(to_degrade, thumbnails):
+                self._history_estimate += estimate_image(thumbnail) - estimate_image(image["source"]["data"])
+                image["source"] = {"type": "base64", "media_type": thumbnail.media_type, "data": thumbnail}
+                self._thumbnail_index.append((content, image))
+            bytes_saved -= sum(base64_length(thumbnail) for thumbnail in thumbnails)
+        else:
+            # no thumbnail tier, so these go straight on to be dropped
+            self._thumbnail_index.extend(to_degrade)
+
+        to_drop = self._take_excess(self._thumbnail_index, policy.thumbnails, policy.chunk_size)
+        for content, image in to_drop:
+            bytes_saved += base64_length(image["source"]["data"])
+            forgotten.append(image["source"]["data"])
+            self._history_estimate -= estimate_image(image["source"]["data"])
+            self._remove_image(content, image)
+        self._forget_images(forgotten)
+        return bytes_saved
+
+    def _forget_images(self, images: list[Any]):
+        """Tell the computer tool that these images are gone from the history the model sees"""
+        forget = getattr(self.tool_collection.tool_map.get("computer"), "forget_images", None)
+        if forget is not None and images:
+            forget(images)
+
+    def _remove_image(self, content: list[Any], image: BetaImageBlockParam):
+        """Delete an image block from its tool_result content by identity"""
+        for i, item in enumerate(content):
+            if item is image:
+                del content[i]
+                return
+
+    def _take_excess(
+        self,
+        index: deque[tuple[list[Any], BetaImageBlockParam]],
+        keep: int,
+        chunk_size: int,
+    ) -> list[tuple[list[Any], BetaImageBlockParam]]:
+        """Pop the oldest entries of an image index beyond keep, a whole chunk at a time"""
+        excess = len(index) - keep
         # for better cache behavior, we want to remove in chunks
-        images_to_remove -= images_to_remove % min_removal_threshold
-
-        for tool_result in tool_result_blocks:
-            if isinstance(tool_result.get("content"), list):
-                new_content = []
-                for content in tool_result.get("content", []):
-                    if isinstance(content, dict) and content.get("type") == "image":
-                        if images_to_remove > 0:
-                            images_to_remove -= 1
-                            continue
-                    new_content.append(content)
-                tool_result["content"] = new_content
+        excess -= excess % chunk_size
+        return [index.popleft() for _ in range(max(excess, 0))]
+
+    def _rebuild_image_index(self, messages: list[BetaMessageParam]):
+        """Index the tool_result images of a history this agent has not seen before"""
+        self._image_index.clear()
+        self._thumbnail_index.clear()
+        self._indexed_messages = messages
+        self._history_estimate, self._estimated_messages = NOTHING, 0
+        for message in messages:
+            if not isinstance(message["content"], list):
+                continue
+            for item in message["content"]:
+                if not (isinstance(item, dict) and item.get("type") == "tool_result"):
+                    continue
+                tool_result = cast(ToolResultBlockParam, item)
+                if isinstance(content := tool_result.get("content"), list):
+                    self._image_index.extend(
+                        (content, image)
+                        for image in content
+                        if isinstance(image, dict) and image.get("type") == "image"
+                    )
 
     def _make_api_tool_result(
         self,
@@ -249,21 +778,25 @@ class ComputerUseAgent:
             is_error = True
             tool_result_content = self._maybe_prepend_system_tool_result(result, result.error)
         else:
-            if result.output:
+            # a result with only system information (such as an exit status) still says so
+            if result.output or result.system:
                 tool_result_content.append({
                     "type": "text",
-                    "text": self._maybe_prepend_system_tool_result(result, result.output),
+                    "text": self._maybe_prepend_system_tool_result(result, result.output or ""),
                 })
-            if result.base64_image:
-                tool_result_content.append({
+            if result.image:
+                image: BetaImageBlockParam = {
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/png",
-                        "data": result.base64_image,
+                        "media_type": result.image.media_type,
+                        # encoded to base64 when a request is built
+                        "data": result.image,
                     },
-                })
-                
+                }
+                tool_result_content.append(image)
+                self._image_index.append((tool_result_content, image))
+
         return {
             "type": "tool_result",
             "content": tool_result_content,
@@ -316,10 +849,18 @@ class SimpleMessageHandler(MessageHandler):
             print(result.output)
         if result.error:
             print(f"Error: {result.error}")
-        if result.base64_image:
+        if result.image:
             print("[Image data available]")
+
+    async def handle_tool_progress(self, output: str, tool_id: str) -> None:
+        print(output, end="", flush=True)
             
     async def handle_model_output(self, content: BetaContentBlock) -> None:
+        # text is saved once its block is complete, so a streamed reply is
+        # written whole rather than a fragment at a time
+        pass
+
+    async def handle_model_output_complete(self, content: BetaContentBlock) -> None:
         print("\nModel Output:")
         if content.type == "text":
             # print(content.text)
@@ -398,10 +939,12 @@ the chat is in firefox and the window is open and it is the only window open in
         
         # Process messages
         handler = SimpleMessageHandler()
-        updated_messages = await agent.process_messages(messages, handler)
+        try:
+            updated_messages = await agent.process_messages(messages, handler)
+        finally:
+            await agent.close()
         
         return updated_messages
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
\ No newline at end of file
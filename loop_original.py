@@ -2,13 +2,14 @@
 Agentic sampling loop that calls the Anthropic API and local implementation of anthropic-defined computer use tools.
 """
 
+import asyncio
 import platform
 from collections.abc import Callable
 from datetime import datetime
-from enum import StrEnum
+from functools import partial
 from typing import Any, cast
 
-from anthropic import Anthropic, AnthropicBedrock, AnthropicVertex, APIResponse
+from anthropic import APIResponse
 from anthropic.types import (
     ToolResultBlockParam,
 )
@@ -22,17 +23,14 @@ from anthropic.types.beta import (
     BetaToolResultBlockParam,
 )
 
+from client_pool import APIProvider, get_client, get_scheduler, warm_connection
 from tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
+from tools.base import encode_images
+from tools.progress import OutputCoalescer
 
 BETA_FLAG = "computer-use-2024-10-22"
 
 
-class APIProvider(StrEnum):
-    ANTHROPIC = "anthropic"
-    BEDROCK = "bedrock"
-    VERTEX = "vertex"
-
-
 PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
     APIProvider.ANTHROPIC: "claude-3-5-sonnet-20241022",
     APIProvider.BEDROCK: "anthropic.claude-3-5-sonnet-20241022-v2:0",
@@ -116,11 +114,14 @@ async def sampling_loop(
     tool_output_callback: Callable[[ToolResult, str], None],
     api_response_callback: Callable[[APIResponse[BetaMessage]], None],
     api_key: str,
+    tool_progress_callback: Callable[[str, str], None] | None = None,
     only_n_most_recent_images: int | None = None,
     max_tokens: int = 4096,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+    tool_progress_callback, if given, gets (output, tool_id) from tools that are
+    still running, a few times a second at most.
     """
     tool_collection = ToolCollection(
         ComputerTool(),
@@ -131,59 +132,83 @@ async def sampling_loop(
         f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}"
     )
 
-    while True:
-        if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(messages, only_n_most_recent_images)
-
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key)
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
-
-        # Call the API
-        # we use raw_response to provide debug information to streamlit. Your
-        # implementation may be able call the SDK directly with:
-        # `response = client.messages.create(...)` instead.
-        raw_response = client.beta.messages.with_raw_response.create(
-            max_tokens=max_tokens,
-            messages=messages,
-            model=model,
-            system=system,
-            tools=tool_collection.to_params(),
-            betas=[BETA_FLAG],
-        )
-
-        api_response_callback(cast(APIResponse[BetaMessage], raw_response))
-
-        response = raw_response.parse()
-
-        messages.append(
-            {
-                "role": "assistant",
-                "content": cast(list[BetaContentBlockParam], response.content),
-            }
-        )
-
-        tool_result_content: list[BetaToolResultBlockParam] = []
-        for content_block in cast(list[BetaContentBlock], response.content):
-            print("CONTENT", content_block)
-            output_callback(content_block)
-            if content_block.type == "tool_use":
-                result = await tool_collection.run(
-                    name=content_block.name,
-                    tool_input=cast(dict[str, Any], content_block.input),
-                )
-                tool_result_content.append(
-                    _make_api_tool_result(result, content_block.id)
+    client = get_client(provider, api_key)
+    scheduler = get_scheduler(provider, api_key)
+    # held here, as the event loop only keeps a weak reference to a task
+    warm_task: asyncio.Task[None] | None = None
+
+    try:
+        while True:
+            if only_n_most_recent_images:
+                removed = _maybe_filter_to_n_most_recent_images(messages, only_n_most_recent_images)
+                # so the computer tool no longer reports "unchanged" against them
+                tool_collection.tool_map["computer"].forget_images(removed)
+
+            # Call the API
+            # we use raw_response to provide debug information to streamlit. Your
+            # implementation may be able call the SDK directly with:
+            # `response = await client.messages.create(...)` instead.
+            # the scheduler holds the request while the rate limits are spent and
+            # retries it if the API is rate limiting or overloaded
+            raw_response = await scheduler.call(
+                lambda: client.beta.messages.with_raw_response.create(
+                    max_tokens=max_tokens,
+                    messages=encode_images(messages),
+                    model=model,
+                    system=system,
+                    tools=tool_collection.to_params(),
+                    betas=[BETA_FLAG],
                 )
-                tool_output_callback(result, content_block.id)
+            )
+
+            api_response_callback(cast(APIResponse[BetaMessage], raw_response))
 
-        if not tool_result_content:
-            return messages
+            response = raw_response.parse()
+
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": cast(list[BetaContentBlockParam], response.content),
+                }
+            )
 
-        messages.append({"content": tool_result_content, "role": "user"})
+            # keep a connection ready for the next request while the tools run
+            if any(block.type == "tool_use" for block in response.content) and (
+                warm_task is None or warm_task.done()
+            ):
+                warm_task = asyncio.create_task(warm_connection(client))
+
+            tool_result_content: list[BetaToolResultBlockParam] = []
+            for content_block in cast(list[BetaContentBlock], response.content):
+                print("CONTENT", content_block)
+                output_callback(content_block)
+                if content_block.type == "tool_use":
+                    progress = (
+                        OutputCoalescer(partial(tool_progress_callback, tool_id=content_block.id))
+                        if tool_progress_callback
+                        else None
+                    )
+                    try:
+                        result = await tool_collection.run(
+                            name=content_block.name,
+                            tool_input=cast(dict[str, Any], content_block.input),
+                            on_output=progress,
+                        )
+                    finally:
+                        if progress:
+                            await progress.close()
+                    tool_result_content.append(
+                        _make_api_tool_result(result, content_block.id)
+                    )
+                    tool_output_callback(result, content_block.id)
+
+            if not tool_result_content:
+                return messages
+
+            messages.append({"content": tool_result_content, "role": "user"})
+    finally:
+        # stops the computer tool's input thread and the bash shell
+        await tool_collection.close()
 
 
 def _maybe_filter_to_n_most_recent_images(
@@ -195,10 +220,11 @@ def _maybe_filter_to_n_most_recent_images(
     With the assumption that images are screenshots that are of diminishing value as
     the conversation progresses, remove all but the final `images_to_keep` tool_result
     images in place, with a chunk of min_removal_threshold to reduce the amount we
-    break the implicit prompt cache.
+    break the implicit prompt cache. Returns the data of the images removed.
     """
+    removed: list[Any] = []
     if images_to_keep is None:
-        return messages
+        return removed
 
     tool_result_blocks = cast(
         list[ToolResultBlockParam],
@@ -230,9 +256,11 @@ def _maybe_filter_to_n_most_recent_images(
                 if isinstance(content, dict) and content.get("type") == "image":
                     if images_to_remove > 0:
                         images_to_remove -= 1
+                        removed.append(content["source"]["data"])
                         continue
                 new_content.append(content)
             tool_result["content"] = new_content
+    return removed
 
 
 def _make_api_tool_result(
@@ -245,21 +273,23 @@ def _make_api_tool_result(
         is_error = True
         tool_result_content = _maybe_prepend_system_tool_result(result, result.error)
     else:
-        if result.output:
+        # a result with only system information (such as an exit status) still says so
+        if result.output or result.system:
             tool_result_content.append(
                 {
                     "type": "text",
-                    "text": _maybe_prepend_system_tool_result(result, result.output),
+                    "text": _maybe_prepend_system_tool_result(result, result.output or ""),
                 }
             )
-        if result.base64_image:
+        if result.image:
             tool_result_content.append(
                 {
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/png",
-                        "data": result.base64_image,
+                        "media_type": result.image.media_type,
+                        # encoded to base64 when a request is built
+                        "data": result.image,
                     },
                 }
             )
@@ -0,0 +1,312 @@
+"""
+Local stand-in for the Messages API, for running the agent loops offline.
+
+Serves POST /v1/messages from a script of responses: each request gets the next
+step of the script, which can be a response (text and tool_use blocks, stop
+reason, usage, latency), a response recorded from the real API, or an error.
+Streaming requests get the same response as server-sent events. Point a client
+at it with base_url, or with ANTHROPIC_BASE_URL:
+
+    python mock_server.py --port 8765 [--script steps.jsonl] [--latency 0.5]
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 python loop.py
+
+Script files are JSON lines, one step per line, e.g.
+
+    {"content": [{"type": "tool_use", "name": "bash", "input": {"command": "ls"}}], "latency": 0.2}
+    {"status": 529, "error": {"type": "overloaded_error", "message": "Overloaded"}}
+    {"content": [{"type": "text", "text": "Done."}], "usage": {"input_tokens": 2000, "output_tokens": 5}}
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+COMPUTER_USE_BETA = "computer-use-2024-10-22"
+COMPUTER_USE_TOOL_TYPES = ("computer_20241022", "bash_20241022", "text_editor_20241022")
+DEFAULT_USAGE = {
+    "input_tokens": 1500,
+    "output_tokens": 60,
+    "cache_creation_input_tokens": 0,
+    "cache_read_input_tokens": 0,
+}
+STREAM_CHUNK_CHARS = 24
+
+# one pass through every tool the agent has, then the end of the task
+DEFAULT_SCRIPT: list[dict[str, Any]] = [
+    {
+        "content": [
+            {"type": "text", "text": "I'll start by taking a screenshot to see the screen."},
+            {"type": "tool_use", "name": "computer", "input": {"action": "screenshot"}},
+        ]
+    },
+    {"content": [{"type": "tool_use", "name": "computer", "input": {"action": "left_click", "coordinate": [640, 400]}}]},
+    {"content": [{"type": "tool_use", "name": "bash", "input": {"command": "echo hello"}}]},
+    {"content": [{"type": "tool_use", "name": "str_replace_editor", "input": {"command": "view", "path": "/tmp"}}]},
+    {"content": [{"type": "text", "text": "The task is complete."}], "stop_reason": "end_turn"},
+]
+
+
+def load_script(path: str | Path) -> list[dict[str, Any]]:
+    """Read a script of steps from a JSON lines file, skipping blank and # lines."""
+    steps = []
+    for line in Path(path).read_text().splitlines():
+        if line.strip() and not line.lstrip().startswith("#"):
+            steps.append(json.loads(line))
+    return steps
+
+
+class MockMessagesServer:
+    """
+    Threaded HTTP server answering Messages API requests from a script, cycling
+    through it when it runs out. `latency` is the default delay before each
+    response, and `error_rate` the chance of answering a request with a 529
+    instead of its step. `headers` are added to every response, e.g. rate limits.
+    """
+
+    def __init__(
+        self,
+        script: list[dict[str, Any]] | None = None,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        headers: dict[str, str] | None = None,
+        record: bool = False,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int | None = None,
+    ):
+        self.script = script or DEFAULT_SCRIPT
+        self.latency = latency
+        self.error_rate = error_rate
+        self.headers = headers or {}
+        self.record = record
+        self.requests: list[dict[str, Any]] = []  # request bodies, if recording
+        self.request_count = 0
+
+        self._steps = itertools.cycle(self.script)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.mock = self  # type: ignore[attr-defined]
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockMessagesServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve in the calling thread, until interrupted."""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockMessagesServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def next_step(self, body: dict[str, Any]) -> dict[str, Any]:
+        with self._lock:
+            self.request_count += 1
+            if self.record:
+                self.requests.append(body)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return {"status": 529, "error": {"type": "overloaded_error", "message": "Overloaded"}}
+            return next(self._steps)
+
+    def message(self, step: dict[str, Any], body: dict[str, Any]) -> dict[str, Any]:
+        """Build the response message for a step, filling in what it leaves out."""
+        if step.get("type") == "message":
+            return step  # recorded from the real API, served as it is
+        with self._lock:
+            message_id = next(self._ids)
+        content = []
+        for i, block in enumerate(step.get("content", [])):
+            if block["type"] == "tool_use" and "id" not in block:
+                block = {**block, "id": f"toolu_mock_{message_id}_{i}"}
+            content.append(block)
+        has_tool_use = any(block["type"] == "tool_use" for block in content)
+        return {
+            "id": f"msg_mock_{message_id}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "content": content,
+            "stop_reason": step.get("stop_reason", "tool_use" if has_tool_use else "end_turn"),
+            "stop_sequence": None,
+            "usage": {**DEFAULT_USAGE, **step.get("usage", {})},
+        }
+
+
+def _error_body(error_type: str, message: str) -> dict[str, Any]:
+    return {"type": "error", "error": {"type": error_type, "message": message}}
+
+
+def _chunks(text: str) -> list[str]:
+    return [text[i : i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+
+
+def stream_events(message: dict[str, Any]) -> list[tuple[str, dict[str, Any]]]:
+    """Split a message into the server-sent events the API streams it as."""
+    events = [
+        (
+            "message_start",
+            {
+                "type": "message_start",
+                "message": {
+                    **message,
+                    "content": [],
+                    "stop_reason": None,
+                    "usage": {**message["usage"], "output_tokens": 1},
+                },
+            },
+        )
+    ]
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "tool_use":
+            start = {**block, "input": {}}
+            deltas = [
+                {"type": "input_json_delta", "partial_json": chunk}
+                for chunk in _chunks(json.dumps(block["input"]))
+            ]
+        else:
+            start = {**block, "text": ""}
+            deltas = [{"type": "text_delta", "text": chunk} for chunk in _chunks(block["text"])]
+        events.append(("content_block_start", {"type": "content_block_start", "index": index, "content_block": start}))
+        for delta in deltas:
+            events.append(("content_block_delta", {"type": "content_block_delta", "index": index, "delta": delta}))
+        events.append(("content_block_stop", {"type": "content_block_stop", "index": index}))
+    events.append(
+        (
+            "message_delta",
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                "usage": {"output_tokens": message["usage"]["output_tokens"]},
+            },
+        )
+    )
+    events.append(("message_stop", {"type": "message_stop"}))
+    return events
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # load tests open many connections at once
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients can reuse connections
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        mock: MockMessagesServer = self.server.mock  # type: ignore[attr-defined]
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+        if self.path.split("?")[0] != "/v1/messages":
+            self._send_json(404, _error_body("not_found_error", f"Not found: {self.path}"), mock)
+            return
+
+        betas = self.headers.get("anthropic-beta", "")
+        if any(tool.get("type") in COMPUTER_USE_TOOL_TYPES for tool in body.get("tools", [])) and (
+            COMPUTER_USE_BETA not in betas
+        ):
+            message = f"Computer use tools need the {COMPUTER_USE_BETA} beta header"
+            self._send_json(400, _error_body("invalid_request_error", message), mock)
+            return
+
+        step = mock.next_step(body)
+        time.sleep(step.get("latency", mock.latency))
+        if "error" in step:
+            error = step["error"]
+            self._send_json(
+                step.get("status", 500),
+                _error_body(error["type"], error.get("message", error["type"])),
+                mock,
+                step.get("headers", {}),
+            )
+            return
+
+        message = mock.message(step, body)
+        if body.get("stream"):
+            self._send_stream(message, mock, step.get("headers", {}))
+        else:
+            self._send_json(200, message, mock, step.get("headers", {}))
+
+    def _send_headers(self, status: int, content_type: str, mock: MockMessagesServer, headers: dict[str, str]):
+        self.send_response(status)
+        self.send_header("content-type", content_type)
+        self.send_header("request-id", f"req_mock_{mock.request_count}")
+        for name, value in {**mock.headers, **headers}.items():
+            self.send_header(name, str(value))
+
+    def _send_json(
+        self,
+        status: int,
+        payload: dict[str, Any],
+        mock: MockMessagesServer,
+        headers: dict[str, str] | None = None,
+    ):
+        data = json.dumps(payload).encode()
+        self._send_headers(status, "application/json", mock, headers or {})
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, message: dict[str, Any], mock: MockMessagesServer, headers: dict[str, str]):
+        self._send_headers(200, "text/event-stream", mock, headers)
+        # without a content length the end of the stream is the end of the connection
+        self.send_header("connection", "close")
+        self.close_connection = True
+        self.end_headers()
+        for name, data in stream_events(message):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Messages API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--script", help="JSON lines file of steps (default: one pass through every tool)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 529")
+    args = parser.parse_args()
+
+    server = MockMessagesServer(
+        script=load_script(args.script) if args.script else None,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        host=args.host,
+        port=args.port,
+    )
+    print(f"Serving the Messages API at {server.base_url}")
+    print(f"export ANTHROPIC_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Client-side scheduling of Messages API requests against the account's rate limits.
+
+A RequestScheduler is shared by every agent using the same API key. It reads the
+anthropic-ratelimit-* headers of each response, holds requests back locally
+while the request or token budget is spent, and retries rate limited (429),
+overloaded (529) and other transient failures with jittered exponential backoff.
+"""
+
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timezone
+from typing import Protocol, TypeVar
+
+import httpx
+from anthropic import APIConnectionError, APIStatusError
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}  # plus every 5xx, including 529 overloaded
+
+
+class _RawResponse(Protocol):
+    @property
+    def headers(self) -> httpx.Headers: ...
+
+
+R = TypeVar("R", bound=_RawResponse)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def _reset_at(value: str | None) -> float | None:
+    """Convert an RFC 3339 reset time from a header to a time.monotonic() deadline"""
+    if not value:
+        return None
+    try:
+        reset = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return time.monotonic() + (reset - datetime.now(timezone.utc)).total_seconds()
+
+
+class RequestScheduler:
+    """Admission control and retries for the requests made with one API key."""
+
+    def __init__(
+        self,
+        max_attempts: int = 8,
+        base_delay: float = 1.0,  # seconds
+        max_delay: float = 60.0,  # seconds
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = asyncio.Lock()
+        self._blocked_until = 0.0
+        self._requests_remaining: int | None = None
+        self._requests_reset: float | None = None
+        self._tokens_remaining: int | None = None
+        self._tokens_reset: float | None = None
+
+    async def call(self, request: Callable[[], Awaitable[R]], estimated_tokens: int = 0) -> R:
+        """
+        Send a request once the local view of the rate limits allows it, retrying
+        transient failures. `request` must return a raw response so its rate limit
+        headers can be read, and is called again for every attempt.
+        """
+        for attempt in range(self.max_attempts):
+            await self._admit(estimated_tokens)
+            try:
+                response = await request()
+            except (APIStatusError, APIConnectionError) as e:
+                if not _is_retryable(e) or attempt == self.max_attempts - 1:
+                    raise
+                delay = self._backoff(attempt)
+                if isinstance(e, APIStatusError):
+                    self.update(e.response.headers)
+                    retry_after = e.response.headers.get("retry-after")
+                    if retry_after and retry_after.replace(".", "", 1).isdigit():
+                        delay = max(delay, float(retry_after))
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+                print(f"Request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                continue
+            self.update(response.headers)
+            return response
+        raise AssertionError("unreachable")
+
+    def update(self, headers: httpx.Headers):
+        """Refresh the local view of the rate limits from a response's headers."""
+        requests_remaining = headers.get("anthropic-ratelimit-requests-remaining")
+        if requests_remaining is not None:
+            self._requests_remaining = int(requests_remaining)
+            self._requests_reset = _reset_at(headers.get("anthropic-ratelimit-requests-reset"))
+
+        # input tokens are what a request is admitted against; fall back to the
+        # combined limit for accounts that only report that one
+        for prefix in ("anthropic-ratelimit-input-tokens", "anthropic-ratelimit-tokens"):
+            tokens_remaining = headers.get(f"{prefix}-remaining")
+            if tokens_remaining is not None:
+                self._tokens_remaining = int(tokens_remaining)
+                self._tokens_reset = _reset_at(headers.get(f"{prefix}-reset"))
+                break
+
+    async def _admit(self, estimated_tokens: int):
+        """Wait until a request of the given size fits the known limits, then reserve it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                limit_wait = 0.0
+                if (
+                    self._requests_remaining is not None
+                    and self._requests_remaining <= 0
+                    and self._requests_reset is not None
+                ):
+                    limit_wait = self._requests_reset - now
+                if (
+                    self._tokens_remaining is not None
+                    and self._tokens_remaining < estimated_tokens
+                    and self._tokens_reset is not None
+                ):
+                    limit_wait = max(limit_wait, self._tokens_reset - now)
+                wait = max(limit_wait, self._blocked_until - now)
+                if wait <= 0:
+                    break
+                if limit_wait > 0:
+                    print(f"Holding request for {wait:.1f}s to stay within rate limits")
+                await asyncio.sleep(wait)
+                # the budget has been refilled by now; the next response says by how much
+                if self._requests_reset is not None and self._requests_reset <= time.monotonic():
+                    self._requests_remaining = None
+                if self._tokens_reset is not None and self._tokens_reset <= time.monotonic():
+                    self._tokens_remaining = None
+
+            # reserve the request locally, so concurrent agents don't all spend the
+            # same remaining budget before any of their responses come back
+            if self._requests_remaining is not None:
+                self._requests_remaining -= 1
+            if self._tokens_remaining is not None:
+                self._tokens_remaining -= estimated_tokens
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
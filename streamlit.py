@@ -3,7 +3,6 @@ Entrypoint for streamlit, see https://docs.streamlit.io/
 """
 
 import asyncio
-import base64
 import os
 import subprocess
 from datetime import datetime
@@ -21,7 +20,8 @@ from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock
 from anthropic.types.tool_use_block import ToolUseBlock
 from streamlit.delta_generator import DeltaGenerator
 
-from loop import (
+from client_pool import close_clients
+from loop_original import (
     PROVIDER_TO_DEFAULT_MODEL_NAME,
     APIProvider,
     sampling_loop,
@@ -49,6 +49,7 @@ STREAMLIT_STYLE = """
 """
 
 WARNING_TEXT = ""
+PROGRESS_CHARS = 4000  # how much of a running tool's output to show
 
 
 class Sender(StrEnum):
@@ -150,6 +151,7 @@ async def main():
             with st.spinner("Resetting..."):
                 st.session_state.clear()
                 setup_state()
+                await close_clients()
 
                 subprocess.run("pkill Xvfb; pkill tint2", shell=True)  # noqa: ASYNC221
                 await asyncio.sleep(1)
@@ -211,6 +213,8 @@ async def main():
             # we don't have a user message to respond to, exit early
             return
 
+        # live output of the tool that is running: tool_id -> (placeholder, output so far)
+        progress: dict[str, tuple[DeltaGenerator, str]] = {}
         with st.spinner("Running Agent..."):
             # run the agent sampling loop with the newest message
             st.session_state.messages = await sampling_loop(
@@ -220,8 +224,9 @@ async def main():
                 messages=st.session_state.messages,
                 output_callback=partial(_render_message, Sender.BOT),
                 tool_output_callback=partial(
-                    _tool_output_callback, tool_state=st.session_state.tools
+                    _tool_output_callback, tool_state=st.session_state.tools, progress_state=progress
                 ),
+                tool_progress_callback=partial(_tool_progress_callback, progress_state=progress),
                 api_response_callback=partial(
                     _api_response_callback,
                     tab=http_logs,
@@ -294,13 +299,33 @@ def _api_response_callback(
 
 
 def _tool_output_callback(
-    tool_output: ToolResult, tool_id: str, tool_state: dict[str, ToolResult]
+    tool_output: ToolResult,
+    tool_id: str,
+    tool_state: dict[str, ToolResult],
+    progress_state: dict[str, tuple[DeltaGenerator, str]],
 ):
-    """Handle a tool output by storing it to state and rendering it."""
+    """Handle a tool output by storing it to state and rendering it, in place of its live output."""
     tool_state[tool_id] = tool_output
+    if tool_id in progress_state:
+        placeholder, _ = progress_state.pop(tool_id)
+        placeholder.empty()
     _render_message(Sender.TOOL, tool_output)
 
 
+def _tool_progress_callback(
+    output: str, tool_id: str, progress_state: dict[str, tuple[DeltaGenerator, str]]
+):
+    """Render the output of a tool that is still running, replacing what was shown before."""
+    if tool_id not in progress_state:
+        progress_state[tool_id] = (st.empty(), "")
+    placeholder, shown = progress_state[tool_id]
+    shown = (shown + output)[-PROGRESS_CHARS:]
+    progress_state[tool_id] = (placeholder, shown)
+    with placeholder.container():
+        with st.chat_message(Sender.TOOL):
+            st.code(shown)
+
+
 def _render_api_response(
     response: APIResponse[BetaMessage], response_id: str, tab: DeltaGenerator
 ):
@@ -346,8 +371,8 @@ def _render_message(
                     st.markdown(message.output)
             if message.error:
                 st.error(message.error)
-            if message.base64_image and not st.session_state.hide_images:
-                st.image(base64.b64decode(message.base64_image))
+            if message.image and not st.session_state.hide_images:
+                st.image(message.image.data)
         elif isinstance(message, BetaTextBlock) or isinstance(message, TextBlock):
             st.write(message.text)
         elif isinstance(message, BetaToolUseBlock) or isinstance(message, ToolUseBlock):
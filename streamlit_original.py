@@ -3,7 +3,6 @@ Entrypoint for streamlit, see https://docs.streamlit.io/
 """
 
 import asyncio
-import base64
 import os
 import subprocess
 from datetime import datetime
@@ -49,6 +48,7 @@ STREAMLIT_STYLE = """
 """
 
 WARNING_TEXT = ""
+PROGRESS_CHARS = 4000  # how much of a running tool's output to show
 
 
 class Sender(StrEnum):
@@ -211,6 +211,8 @@ async def main():
             # we don't have a user message to respond to, exit early
             return
 
+        # live output of the tool that is running: tool_id -> (placeholder, output so far)
+        progress: dict[str, tuple[DeltaGenerator, str]] = {}
         with st.spinner("Running Agent..."):
             # run the agent sampling loop with the newest message
             st.session_state.messages = await sampling_loop(
@@ -220,8 +222,9 @@ async def main():
                 messages=st.session_state.messages,
                 output_callback=partial(_render_message, Sender.BOT),
                 tool_output_callback=partial(
-                    _tool_output_callback, tool_state=st.session_state.tools
+                    _tool_output_callback, tool_state=st.session_state.tools, progress_state=progress
                 ),
+                tool_progress_callback=partial(_tool_progress_callback, progress_state=progress),
                 api_response_callback=partial(
                     _api_response_callback,
                     tab=http_logs,
@@ -294,13 +297,33 @@ def _api_response_callback(
 
 
 def _tool_output_callback(
-    tool_output: ToolResult, tool_id: str, tool_state: dict[str, ToolResult]
+    tool_output: ToolResult,
+    tool_id: str,
+    tool_state: dict[str, ToolResult],
+    progress_state: dict[str, tuple[DeltaGenerator, str]],
 ):
-    """Handle a tool output by storing it to state and rendering it."""
+    """Handle a tool output by storing it to state and rendering it, in place of its live output."""
     tool_state[tool_id] = tool_output
+    if tool_id in progress_state:
+        placeholder, _ = progress_state.pop(tool_id)
+        placeholder.empty()
     _render_message(Sender.TOOL, tool_output)
 
 
+def _tool_progress_callback(
+    output: str, tool_id: str, progress_state: dict[str, tuple[DeltaGenerator, str]]
+):
+    """Render the output of a tool that is still running, replacing what was shown before."""
+    if tool_id not in progress_state:
+        progress_state[tool_id] = (st.empty(), "")
+    placeholder, shown = progress_state[tool_id]
+    shown = (shown + output)[-PROGRESS_CHARS:]
+    progress_state[tool_id] = (placeholder, shown)
+    with placeholder.container():
+        with st.chat_message(Sender.TOOL):
+            st.code(shown)
+
+
 def _render_api_response(
     response: APIResponse[BetaMessage], response_id: str, tab: DeltaGenerator
 ):
@@ -346,8 +369,8 @@ def _render_message(
                     st.markdown(message.output)
             if message.error:
                 st.error(message.error)
-            if message.base64_image and not st.session_state.hide_images:
-                st.image(base64.b64decode(message.base64_image))
+            if message.image and not st.session_state.hide_images:
+                st.image(message.image.data)
         elif isinstance(message, BetaTextBlock) or isinstance(message, TextBlock):
             st.write(message.text)
         elif isinstance(message, BetaToolUseBlock) or isinstance(message, ToolUseBlock):
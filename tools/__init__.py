@@ -1,4 +1,4 @@
-from .base import CLIResult, ToolResult
+from .base import CLIResult, ImageData, ToolResult
 from .bash import BashTool
 from .collection import ToolCollection
 from .computer import ComputerTool
@@ -9,6 +9,7 @@ __ALL__ = [
     CLIResult,
     ComputerTool,
     EditTool,
+    ImageData,
     ToolCollection,
     ToolResult,
 ]
@@ -1,3 +1,4 @@
+import base64
 from abc import ABCMeta, abstractmethod
 from dataclasses import dataclass, fields, replace
 from typing import Any
@@ -20,13 +21,74 @@ class BaseAnthropicTool(metaclass=ABCMeta):
         raise NotImplementedError
 
 
+class ImageData:
+    """
+    An encoded image, held as raw bytes.
+
+    Only the raw bytes are kept. The base64 form a request needs is made when
+    the request is built (an ImageRef gets it from its store, which keeps a
+    bounded cache of them). The UI shows the bytes as they are.
+    """
+
+    def __init__(self, data: bytes, media_type: str = "image/png"):
+        self._data = data
+        self.media_type = media_type
+
+    @property
+    def data(self) -> bytes:
+        return self._data
+
+    @property
+    def size(self) -> int:
+        """Length of the raw image in bytes"""
+        return len(self._data)
+
+    @property
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode()
+
+
+def image_bytes(data: "str | ImageData") -> bytes:
+    """The raw bytes of an image block's data, whether an ImageData or base64."""
+    return data.data if isinstance(data, ImageData) else base64.b64decode(data)
+
+
+def base64_length(data: "str | ImageData") -> int:
+    """The length of an image block's data once base64 encoded for a request."""
+    return (data.size + 2) // 3 * 4 if isinstance(data, ImageData) else len(data)
+
+
+def encode_images(messages: list[Any]) -> list[Any]:
+    """
+    The message history as a request sends it: a copy in which the data of every
+    image block is its base64 string rather than the ImageData the history holds.
+    Only the messages and blocks on the way to an image are copied.
+    """
+    return [
+        {**message, "content": [_encode_block(block) for block in message["content"]]}
+        if isinstance(message["content"], list)
+        else message
+        for message in messages
+    ]
+
+
+def _encode_block(block: Any) -> Any:
+    if not isinstance(block, dict):
+        return block
+    if block.get("type") == "tool_result" and isinstance(block.get("content"), list):
+        return {**block, "content": [_encode_block(item) for item in block["content"]]}
+    if block.get("type") == "image" and isinstance(data := block["source"].get("data"), ImageData):
+        return {**block, "source": {**block["source"], "data": data.base64}}
+    return block
+
+
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
     """Represents the result of a tool execution."""
 
     output: str | None = None
     error: str | None = None
-    base64_image: str | None = None
+    image: ImageData | None = None
     system: str | None = None
 
     def __bool__(self):
@@ -45,7 +107,7 @@ class ToolResult:
         return ToolResult(
             output=combine_fields(self.output, other.output),
             error=combine_fields(self.error, other.error),
-            base64_image=combine_fields(self.base64_image, other.base64_image, False),
+            image=combine_fields(self.image, other.image, False),
             system=combine_fields(self.system, other.system),
         )
 
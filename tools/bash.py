@@ -1,10 +1,106 @@
 import asyncio
+import codecs
+import contextlib
 import os
-from typing import ClassVar, Literal
+import secrets
+import shutil
+import signal
+import tempfile
+from pathlib import Path
+from typing import Callable, ClassVar, Literal, TextIO
 
 from anthropic.types.beta import BetaToolBash20241022Param
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
+from .capture import OutputCapture
+from .progress import OutputCallback
+
+
+class _SentinelReader:
+    """
+    Reads one of the shell's output streams as it is written, into a bounded
+    OutputCapture per command, and notices the sentinel line printed after each
+    command as soon as it arrives. Only the few bytes that could be the start of
+    a sentinel split across reads are held back. Output is also passed to
+    `listener`, if set, as it is read.
+    """
+
+    _chunk_size: int = 2**16
+
+    def __init__(self, stream: asyncio.StreamReader, sentinel: bytes, new_capture: Callable[[], OutputCapture]):
+        self._stream = stream
+        self._marker = b"\n" + sentinel
+        self._new_capture = new_capture
+        self._capture = new_capture()
+        self._pending = bytearray()
+        self._done = asyncio.Event()
+        self._result: tuple[OutputCapture, str | None] | None = None
+        self.listener: Callable[[bytes], None] | None = None
+        self._task = asyncio.create_task(self._read())
+
+    async def wait(self) -> tuple[OutputCapture, str | None]:
+        """
+        Wait for the sentinel and return the output before it with whatever the
+        sentinel line carried (the exit status, on stdout), or None if the shell
+        exited first.
+        """
+        await self._done.wait()
+        self._done.clear()
+        result, self._result = self._result, None
+        return result
+
+    async def close(self):
+        """Stop reading."""
+        self._task.cancel()
+        await asyncio.wait({self._task})
+
+    def peek(self) -> str:
+        """The output of the command still running, as far as it has been read."""
+        return self._capture.text()
+
+    async def _read(self):
+        while chunk := await self._stream.read(self._chunk_size):
+            self._pending += chunk
+            while self._scan():
+                pass
+        # the shell has exited, so no sentinel is coming
+        self._write(self._pending)
+        self._pending.clear()
+        self._finish(None)
+
+    def _scan(self) -> bool:
+        """Pass pending output on to the capture, up to a complete sentinel line if there is one."""
+        start = self._pending.find(self._marker)
+        if start == -1:
+            # hold back only what could be the start of a sentinel line, so short
+            # output is passed on as soon as it arrives
+            keep = self._pending.rfind(b"\n", max(0, len(self._pending) - len(self._marker) + 1))
+            if keep == -1 or not self._marker.startswith(self._pending[keep:]):
+                keep = len(self._pending)
+            self._write(self._pending[:keep])
+            del self._pending[:keep]
+            return False
+        self._write(self._pending[:start])
+        del self._pending[:start]
+        end = self._pending.find(b"\n", len(self._marker))
+        if end == -1:  # the rest of the sentinel line is still on its way
+            return False
+        status = self._pending[len(self._marker) : end].decode()
+        # anything after the sentinel came from a background job; it goes to the next command
+        del self._pending[: end + 1]
+        self._finish(status)
+        return True
+
+    def _write(self, data: bytearray):
+        self._capture.write(data)
+        if self.listener is not None and data:
+            self.listener(bytes(data))
+
+    def _finish(self, status: str | None):
+        self._capture.close()
+        self._result = (self._capture, status)
+        self._capture = self._new_capture()
+        self._done.set()
 
 
 class _BashSession:
@@ -14,13 +110,20 @@ class _BashSession:
     _process: asyncio.subprocess.Process
 
     command: str = "/bin/bash"
-    _output_delay: float = 0.2  # seconds
     _timeout: float = 120.0  # seconds
+    _stop_timeout: float = 5.0  # seconds to exit after SIGTERM before SIGKILL
     _sentinel: str = "<<exit>>"
+    # output kept in memory per command and stream; the rest is only in a file
+    _head_bytes: int = 8 * 1024
+    _tail_bytes: int = 8 * 1024
 
     def __init__(self):
         self._started = False
         self._timed_out = False
+        # unique to the session, so output that happens to contain "<<exit>>" is not taken for it
+        self._token = f"{self._sentinel}{secrets.token_hex(8)}"
+        # where outputs too long to keep go, until the session stops
+        self._spill_dir = Path(tempfile.gettempdir()) / f"bash_output_{secrets.token_hex(4)}"
 
     async def start(self):
         if self._started:
@@ -35,19 +138,33 @@ class _BashSession:
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
         )
+        # we know these are not None because we created the process with PIPEs
+        assert self._process.stdout
+        assert self._process.stderr
+        self._stdout = _SentinelReader(self._process.stdout, self._token.encode(), self._new_capture)
+        self._stderr = _SentinelReader(self._process.stderr, self._token.encode(), self._new_capture)
 
         self._started = True
 
-    def stop(self):
-        """Terminate the bash shell."""
+    async def stop(self):
+        """Terminate the bash shell, with the commands it is running, and wait for it to exit."""
         if not self._started:
             raise ToolError("Session has not started.")
-        if self._process.returncode is not None:
-            return
-        self._process.terminate()
+        # the shell leads its own process group (see start), so this also ends what it
+        # started, even where /bin/sh runs bash as a child rather than exec'ing it
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(self._process.pid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(self._process.wait(), self._stop_timeout)
+        except asyncio.TimeoutError:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(self._process.pid, signal.SIGKILL)
+            await self._process.wait()
+        await asyncio.gather(self._stdout.close(), self._stderr.close())
+        shutil.rmtree(self._spill_dir, ignore_errors=True)
 
-    async def run(self, command: str):
-        """Execute a command in the bash shell."""
+    async def run(self, command: str, on_output: OutputCallback | None = None):
+        """Execute a command in the bash shell, passing its output to `on_output` as it arrives."""
         if not self._started:
             raise ToolError("Session has not started.")
         if self._process.returncode is not None:
@@ -60,83 +177,212 @@ class _BashSession:
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             )
 
-        # we know these are not None because we created the process with PIPEs
         assert self._process.stdin
-        assert self._process.stdout
-        assert self._process.stderr
 
-        # send command to the process
+        # send the command, then a sentinel line on each stream: the one on stdout
+        # carries the command's exit status, and the newline before each one means
+        # it starts a line even if the command's output did not end with one
         self._process.stdin.write(
-            command.encode() + f"; echo '{self._sentinel}'\n".encode()
+            f"{command}\n"
+            f"printf '\\n{self._token}%s\\n' \"$?\"; printf '\\n{self._token}\\n' >&2\n".encode()
         )
         await self._process.stdin.drain()
 
-        # read output from the process, until the sentinel is found
+        if on_output is not None:
+            for reader in (self._stdout, self._stderr):
+                # one decoder per stream, for characters split across reads
+                decode = codecs.getincrementaldecoder("utf-8")(errors="replace").decode
+                reader.listener = lambda data, decode=decode: on_output(decode(data))
+
+        # wait until both sentinels have been read
         try:
             async with asyncio.timeout(self._timeout):
-                while True:
-                    await asyncio.sleep(self._output_delay)
-                    # if we read directly from stdout/stderr, it will wait forever for
-                    # EOF. use the StreamReader buffer directly instead.
-                    output = self._process.stdout._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-                    if self._sentinel in output:
-                        # strip the sentinel and break
-                        output = output[: output.index(self._sentinel)]
-                        break
+                (stdout, status), (stderr, _) = await asyncio.gather(self._stdout.wait(), self._stderr.wait())
         except asyncio.TimeoutError:
             self._timed_out = True
             raise ToolError(
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             ) from None
+        finally:
+            self._stdout.listener = self._stderr.listener = None
 
+        output = stdout.text()
         if output.endswith("\n"):
             output = output[:-1]
 
-        error = self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
+        error = stderr.text()
         if error.endswith("\n"):
             error = error[:-1]
 
-        # clear the buffers so that the next output can be read correctly
-        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+        if status is None:
+            returncode = await self._process.wait()
+            return CLIResult(
+                output=output,
+                error=error,
+                system=f"tool must be restarted: bash has exited with returncode {returncode}",
+            )
+        return CLIResult(
+            output=output,
+            error=error,
+            system=f"exit status {status}" if status != "0" else None,
+        )
+
+    def output_so_far(self) -> tuple[str, str]:
+        """The stdout and stderr of the command still running, as far as they have been read."""
+        return self._stdout.peek(), self._stderr.peek()
+
+    def _new_capture(self) -> OutputCapture:
+        return OutputCapture(self._head_bytes, self._tail_bytes, spill_dir=self._spill_dir)
+
+
+class _BackgroundJob:
+    """
+    A command run by the bash tool, in its own shell. Its output goes to
+    `on_output` until it is set aside, and to a log file after that.
+    """
+
+    def __init__(self, session: _BashSession, command: str, on_output: OutputCallback | None):
+        self.session = session
+        self.on_output = on_output
+        self.path: Path | None = None
+        self._log: TextIO | None = None
+        self.task: asyncio.Task[ToolResult] = asyncio.create_task(session.run(command, self._write))
+
+    def set_aside(self, path: Path):
+        self.path = path
+        self._log = path.open("w", encoding="utf-8")
 
-        return CLIResult(output=output, error=error)
+    async def finish(self, note: str):
+        """Stop the shell and close the log with a last line saying how the job ended."""
+        self.task.cancel()
+        await self.session.stop()
+        if self._log is not None:
+            self._log.write(f"\n[{note}]\n")
+            self._log.close()
+            self._log = None
+
+    def _write(self, text: str):
+        if self._log is not None:
+            self._log.write(text)
+            self._log.flush()
+        elif self.on_output is not None:
+            self.on_output(text)
 
 
 class BashTool(BaseAnthropicTool):
     """
     A tool that allows the agent to run bash commands.
     The tool parameters are defined by Anthropic and are not editable.
+
+    A command still running after `background_after` seconds is left running in
+    its shell, which is set aside as a background job, and the next command runs
+    in a new shell, so a build or a server does not hold up every command after
+    it. The job's output from then on goes to a log file named in the result, and
+    its shell is stopped when it finishes. At most `max_background` jobs are kept
+    running; setting one more aside stops the oldest.
     """
 
     _session: _BashSession | None
     name: ClassVar[Literal["bash"]] = "bash"
     api_type: ClassVar[Literal["bash_20241022"]] = "bash_20241022"
 
-    def __init__(self):
+    def __init__(self, background_after: float | None = _BashSession._timeout, max_background: int = 4):
         self._session = None
+        self.background_after = background_after
+        self.max_background = max_background
+        self._background: list[_BackgroundJob] = []
+        self._logs: list[Path] = []
+        # shells of finished jobs being stopped, held so they are not garbage collected
+        self._stopping: set[asyncio.Task[None]] = set()
         super().__init__()
 
     async def __call__(
-        self, command: str | None = None, restart: bool = False, **kwargs
+        self,
+        command: str | None = None,
+        restart: bool = False,
+        on_output: OutputCallback | None = None,
+        **kwargs,
     ):
         if restart:
             if self._session:
-                self._session.stop()
-            self._session = _BashSession()
-            await self._session.start()
+                await self._session.stop()
+            self._session = await self._new_session()
 
             return ToolResult(system="tool has been restarted.")
 
         if self._session is None:
-            self._session = _BashSession()
-            await self._session.start()
+            self._session = await self._new_session()
 
         if command is not None:
-            return await self._session.run(command)
+            return await self._run(command, on_output)
 
         raise ToolError("no command provided.")
 
+    async def close(self):
+        """Stop the shell and every background job, wait for them to exit, and remove their logs."""
+        if self._session is not None:
+            await self._session.stop()
+            self._session = None
+        jobs, self._background = self._background, []
+        for job in jobs:
+            await job.finish("stopped")
+        await asyncio.gather(*self._stopping)
+        for path in self._logs:
+            path.unlink(missing_ok=True)
+        self._logs.clear()
+
+    async def _new_session(self) -> _BashSession:
+        session = _BashSession()
+        # the tool decides how long to wait for a command itself, and sets it aside
+        # rather than give up on it
+        session._timeout = None
+        await session.start()
+        return session
+
+    async def _run(self, command: str, on_output: OutputCallback | None) -> ToolResult:
+        assert self._session is not None
+        job = _BackgroundJob(self._session, command, on_output)
+        try:
+            done, _ = await asyncio.wait({job.task}, timeout=self.background_after)
+        except asyncio.CancelledError:
+            job.task.cancel()
+            raise
+        if done:
+            return job.task.result()
+
+        # leave the command running and give the next one a new shell
+        output, error = self._session.output_so_far()
+        self._session = await self._new_session()
+        if len(self._background) >= self.max_background:
+            await self._background.pop(0).finish("stopped to make room for a newer background job")
+        path = Path(tempfile.gettempdir()) / f"bash_background_{secrets.token_hex(4)}.log"
+        job.set_aside(path)
+        self._background.append(job)
+        self._logs.append(path)
+        job.task.add_done_callback(lambda task: self._job_done(job))
+        return CLIResult(
+            output=output,
+            error=error,
+            system=(
+                f"still running after {self.background_after:g} seconds, so it was left running in the background"
+                f" and the next command runs in a new shell; its further output goes to {path}"
+            ),
+        )
+
+    def _job_done(self, job: _BackgroundJob):
+        if job not in self._background:  # already stopped
+            return
+        self._background.remove(job)
+        if job.task.cancelled():
+            note = "cancelled"
+        elif job.task.exception() is not None:
+            note = str(job.task.exception())
+        else:
+            note = job.task.result().system or "exit status 0"
+        task = asyncio.create_task(job.finish(note))
+        self._stopping.add(task)
+        task.add_done_callback(self._stopping.discard)
+
     def to_params(self) -> BetaToolBash20241022Param:
         return {
             "type": self.api_type,
@@ -0,0 +1,108 @@
+"""
+Bounded capture of command output.
+
+Only the first and last bytes of a command's output are kept in memory, however
+much it writes. With a spill directory, the whole output is also streamed to a
+file there once it outgrows that, so the agent can still read the part that
+was left out.
+"""
+
+import codecs
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+
+class OutputCapture:
+    """
+    Collects a stream of output, keeping `head_bytes` from the start and
+    `tail_bytes` from the end in memory. With a `spill_dir`, output that does not
+    fit is written, whole, to a file there, up to `max_spill_bytes`.
+    """
+
+    def __init__(
+        self,
+        head_bytes: int = 8 * 1024,
+        tail_bytes: int = 8 * 1024,
+        spill_dir: str | Path | None = None,
+        max_spill_bytes: int = 2**30,
+    ):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.total_bytes = 0
+        self.path: Path | None = None  # the spill file, once there is one
+        self._newlines = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._file: BinaryIO | None = None
+        self._spilled = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > len(self._head) + len(self._tail)
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        self.total_bytes += len(data)
+        self._newlines += data.count(b"\n")
+
+        if len(self._head) < self.head_bytes:
+            room = self.head_bytes - len(self._head)
+            self._head += data[:room]
+            data = data[room:]
+        self._tail += data
+        overflow = len(self._tail) - self.tail_bytes
+        if overflow > 0:
+            self._spill(self._tail[:overflow])
+            del self._tail[:overflow]
+
+    def close(self):
+        """Finish the spill file, if there is one."""
+        if self._file is not None:
+            self._spill(self._tail)
+            self._file.close()
+            self._file = None
+
+    def text(self, guidance: str = "") -> str:
+        """
+        The output kept in memory, with a note of what was left out if anything
+        was, followed by `guidance` on how to find it.
+        """
+        if not self.truncated:
+            return (self._head + self._tail).decode(errors="replace")
+        # the cuts are moved to character boundaries, so no character is split
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        head = decoder.decode(self._head)
+        head_bytes = len(self._head) - len(decoder.getstate()[0])  # less a character cut short
+        start = 0
+        while start < min(3, len(self._tail)) and self._tail[start] & 0xC0 == 0x80:
+            start += 1
+        tail = self._tail[start:].decode(errors="replace")
+
+        omitted = self.total_bytes - head_bytes - (len(self._tail) - start)
+        omitted_lines = self._newlines - self._head[:head_bytes].count(b"\n") - self._tail[start:].count(b"\n")
+        note = f"... output truncated: {omitted} of {self.total_bytes} bytes ({omitted_lines} lines) left out."
+        if self.path is not None:
+            if self._spilled < self.total_bytes:
+                note += f" The first {self._spilled} bytes are saved at {self.path}"
+            else:
+                note += f" The full output is saved at {self.path}"
+        if guidance:
+            note += f"\n{guidance}"
+        return f"{head}\n{note}\n{tail}"
+
+    def _spill(self, data: bytes | bytearray):
+        if self.spill_dir is None or self._spilled >= self.max_spill_bytes:
+            return
+        if self._file is None:
+            Path(self.spill_dir).mkdir(parents=True, exist_ok=True)
+            self._file = tempfile.NamedTemporaryFile(dir=self.spill_dir, prefix="output_", suffix=".log", delete=False)
+            self.path = Path(self._file.name)
+            self._file.write(self._head)
+            self._spilled = len(self._head)
+        data = data[: self.max_spill_bytes - self._spilled]
+        self._file.write(data)
+        self._spilled += len(data)
@@ -1,5 +1,6 @@
 """Collection classes for managing multiple tools."""
 
+import inspect
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
@@ -10,6 +11,7 @@ from .base import (
     ToolFailure,
     ToolResult,
 )
+from .progress import OutputCallback
 
 
 class ToolCollection:
@@ -24,10 +26,24 @@ class ToolCollection:
     ) -> list[BetaToolUnionParam]:
         return [tool.to_params() for tool in self.tools]
 
-    async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
+    async def close(self):
+        """Release what the tools hold on to, for those that hold anything."""
+        for tool in self.tools:
+            close = getattr(tool, "close", None)
+            if close is not None:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+
+    async def run(
+        self, *, name: str, tool_input: dict[str, Any], on_output: OutputCallback | None = None
+    ) -> ToolResult:
+        """Run a tool. Tools that produce output over time (bash) pass it to `on_output` as they go."""
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
+        if on_output is not None:
+            tool_input = {**tool_input, "on_output": on_output}
         try:
             return await tool(**tool_input)
         except ToolError as e:
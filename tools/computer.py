@@ -1,23 +1,31 @@
 import asyncio
-import base64
-import os
-import shlex
-import pyautogui
-import keyboard
+from collections.abc import Iterable
 from enum import StrEnum
-from pathlib import Path
 from typing import Literal, TypedDict
-from uuid import uuid4
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
-from .base import BaseAnthropicTool, ToolError, ToolResult
+from .base import BaseAnthropicTool, ImageData, ToolError, ToolResult, base64_length
+from .encoder import ImageEncoding, encode_image, encoder_pool
+from .frames import (
+    CROP_MESSAGE,
+    UNCHANGED_MESSAGE,
+    FrameDiffPolicy,
+    FrameStats,
+    FrameStore,
+    SettlePolicy,
+    changed_box,
+    changed_mask,
+    image_tokens,
+    is_unchanged,
+    remove_stale_screenshots,
+    to_rgb,
+    wait_for_settle,
+)
+from .image_store import ImageStore, image_store
+from .input import InputDriver, InputWorker, TypingPolicy, get_input_driver
 from .run import run
-
-OUTPUT_DIR = "/tmp/outputs"
-
-TYPING_DELAY_MS = 12
-TYPING_GROUP_SIZE = 50
+from .screen import ScreenBackend, get_screen_backend, scale_frame
 
 Action = Literal[
     "key",
@@ -59,15 +67,10 @@ class ComputerToolOptions(TypedDict):
     display_number: int | None
 
 
-def chunks(s: str, chunk_size: int) -> list[str]:
-    return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
-
-
 class ComputerTool(BaseAnthropicTool):
     """
     A tool that allows the agent to interact with the screen, keyboard, and mouse of the current macOS computer.
     The tool parameters are defined by Anthropic and are not editable.
-    Requires cliclick to be installed: brew install cliclick
     """
 
     name: Literal["computer"] = "computer"
@@ -76,7 +79,8 @@ class ComputerTool(BaseAnthropicTool):
     height: int
     display_num: int | None
 
-    _screenshot_delay = 1.0  # macOS is generally faster than X11
+    _screenshot_delay = 1.0  # fixed wait before a screenshot when settle detection is off
+    _stale_screenshots_removed = False  # once per process, by the first tool built
     _scaling_enabled = True
 
     @property
@@ -90,13 +94,61 @@ class ComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
-    def __init__(self):
+    def __init__(
+        self,
+        screen_backend: ScreenBackend | str | None = None,
+        frame_diff: FrameDiffPolicy | None = FrameDiffPolicy(),
+        settle: SettlePolicy | None = SettlePolicy(),
+        frame_store: FrameStore | None = None,
+        encoding: ImageEncoding = ImageEncoding(),
+        images: ImageStore | None = None,
+        input_driver: InputDriver | str | None = None,
+        typing: TypingPolicy = TypingPolicy(),
+    ):
+        """
+        `frame_diff` decides when a screenshot shows the same screen as the last one
+        sent to the model, in which case a short text is returned instead of the
+        image, and whether changes are sent as crops. Pass None to always send the
+        whole image.
+        `settle` decides how a screenshot waits for the screen to stop changing
+        after an action. Pass None to wait a fixed _screenshot_delay instead.
+        Every image sent is kept in `frame_store`, by default a new FrameStore.
+        `encoding` chooses the image format of each frame.
+        The images returned are references into `images`, by default the shared
+        image_store, which keeps a single copy of identical frames.
+        Mouse and keyboard actions go through `input_driver` (see input.py), and
+        `typing` decides when text is pasted instead of typed.
+        """
         super().__init__()
 
-        self.width, self.height = pyautogui.size()
+        if not isinstance(screen_backend, ScreenBackend):
+            screen_backend = get_screen_backend(screen_backend)
+        self.screen_backend = screen_backend
+        self.width, self.height = screen_backend.size()
         assert self.width and self.height, "WIDTH, HEIGHT must be set"
         self.display_num = None  # macOS doesn't use X11 display numbers
 
+        if not isinstance(input_driver, InputDriver):
+            input_driver = get_input_driver(input_driver)
+        self.input = InputWorker(input_driver, typing)
+
+        self.frame_diff = frame_diff
+        self.settle = settle
+        self.encoding = encoding
+        self.frame_stats = FrameStats()
+        self.frame_store = frame_store if frame_store is not None else FrameStore()
+        self.images = images if images is not None else image_store
+        if not ComputerTool._stale_screenshots_removed:
+            ComputerTool._stale_screenshots_removed = True
+            remove_stale_screenshots()
+        # the screen as the model last saw it: the last full frame with any crops
+        # sent since pasted in
+        self._model_frame = None
+        # the images that frame was built from, which the model has to still have
+        self._model_images: list[ImageData] = []
+        self._full_frame_bytes = 0
+        self._crops_since_full_frame = 0
+
     async def __call__(
         self,
         *,
@@ -119,9 +171,10 @@ class ComputerTool(BaseAnthropicTool):
             x, y = self.scale_coordinates(ScalingSource.API, coordinate[0], coordinate[1])
 
             if action == "mouse_move":
-                return await self.shell(f"cliclick m:{x},{y}")
+                await self.input.move(x, y)
             elif action == "left_click_drag":
-                return await self.shell(f"cliclick dd:{x},{y}")
+                await self.input.drag(x, y)
+            return ToolResult()
 
         if action in ("key", "type"):
             if text is None:
@@ -150,35 +203,17 @@ class ComputerTool(BaseAnthropicTool):
                 }
 
                 try:
-                    if "+" in text:
-                        # Handle combinations like "ctrl+c"
-                        keys = text.split("+")
-                        mapped_keys = [key_map.get(k.strip(), k.strip()) for k in keys]
-                        await asyncio.get_event_loop().run_in_executor(
-                            None, keyboard.press_and_release, '+'.join(mapped_keys)
-                        )
-                    else:
-                        # Handle single keys
-                        mapped_key = key_map.get(text, text)
-                        await asyncio.get_event_loop().run_in_executor(
-                            None, keyboard.press_and_release, mapped_key
-                        )
-
-                    return ToolResult(output=f"Pressed key: {text}", error=None, base64_image=None)
-
-                except Exception as e:
-                    return ToolResult(output=None, error=str(e), base64_image=None)
+                    # a single key, or a combination like "ctrl+c"
+                    keys = [key_map.get(k.strip(), k.strip()) for k in text.split("+")]
+                    await self.input.press(keys)
+                    return ToolResult(output=f"Pressed key: {text}", error=None, image=None)
+
+                except ToolError as e:
+                    return ToolResult(output=None, error=e.message, image=None)
             elif action == "type":
-                results: list[ToolResult] = []
-                for chunk in chunks(text, TYPING_GROUP_SIZE):
-                    cmd = f"cliclick w:{TYPING_DELAY_MS} t:{shlex.quote(chunk)}"
-                    results.append(await self.shell(cmd, take_screenshot=False))
-                screenshot_base64 = (await self.screenshot()).base64_image
-                return ToolResult(
-                    output="".join(result.output or "" for result in results),
-                    error="".join(result.error or "" for result in results),
-                    base64_image=screenshot_base64,
-                )
+                pasted, seconds = await self.input.type_text(text)
+                print(f"{'Pasted' if pasted else 'Typed'} {len(text)} characters in {seconds:.2f}s")
+                return await self._attach_screenshot(ToolResult())
 
         if action in (
             "left_click",
@@ -194,63 +229,133 @@ class ComputerTool(BaseAnthropicTool):
                 raise ToolError(f"coordinate is not accepted for {action}")
 
             if action == "screenshot":
+                # the model usually asks for one right after an action that returned none
+                await self._wait_for_settle(fixed_delay=False)
                 return await self.screenshot()
             elif action == "cursor_position":
-                result = await self.shell(
-                    "cliclick p",
-                    take_screenshot=False,
-                )
-                import pdb; pdb.set_trace()
-                if result.output:
-                    x, y = map(int, result.output.strip().split(","))
-                    x, y = self.scale_coordinates(ScalingSource.COMPUTER, x, y)
-                    return result.replace(output=f"X={x},Y={y}")
-                return result
+                x, y = await self.input.cursor_position()
+                x, y = self.scale_coordinates(ScalingSource.COMPUTER, x, y)
+                return ToolResult(output=f"X={x},Y={y}")
             else:
-                click_cmd = {
-                    "left_click": "c:.",
-                    "right_click": "rc:.",
-                    "middle_click": "mc:.",
-                    "double_click": "dc:.",
+                button, count = {
+                    "left_click": ("left", 1),
+                    "right_click": ("right", 1),
+                    "middle_click": ("middle", 1),
+                    "double_click": ("left", 2),
                 }[action]
-                return await self.shell(f"cliclick {click_cmd}")
+                await self.input.click(button, count)
+                return ToolResult()
 
         raise ToolError(f"Invalid action: {action}")
 
     async def screenshot(self):
-        """Take a screenshot of the current screen and return the base64 encoded image."""
-        output_dir = Path(OUTPUT_DIR)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / f"screenshot_{uuid4().hex}.png"
-
-        # Use macOS native screencapture
-        screenshot_cmd = f"screencapture -x {path}"
-        result = await self.shell(screenshot_cmd, take_screenshot=False)
+        """
+        Take a screenshot of the current screen and return the encoded image,
+        or a note that the screen has not changed since the last image sent.
+        """
+        return await asyncio.get_running_loop().run_in_executor(encoder_pool, self._screenshot)
 
+    def _screenshot(self) -> ToolResult:
+        """Grab, compare, scale and encode a frame in memory. Blocking."""
+        image = self.screen_backend.capture()
         if self._scaling_enabled:
-            x, y = SCALE_DESTINATION['width'], SCALE_DESTINATION['height']
-            await self.shell(
-                f"sips -z {y} {x} {path}",  # sips is macOS native image processor
-                take_screenshot=False
-            )
-
-        if path.exists():
-            return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
-            )
-        raise ToolError(f"Failed to take screenshot: {result.error}")
+            image = scale_frame(image, (SCALE_DESTINATION["width"], SCALE_DESTINATION["height"]))
+        self.frame_stats.frames += 1
+        policy = self.frame_diff
+        if policy is None:
+            return self._encode(image)
+
+        frame = to_rgb(image)
+        mask = changed_mask(self._model_frame, frame, policy.pixel_threshold)
+        if mask is not None and is_unchanged(mask, policy):
+            self.frame_stats.frames_unchanged += 1
+            self.frame_stats.image_bytes_saved += self._full_frame_bytes
+            self.frame_stats.image_tokens_saved += image_tokens(*image.size)
+            return ToolResult(output=UNCHANGED_MESSAGE)
+
+        if mask is not None and policy.crop_changes and self._crops_since_full_frame < policy.full_frame_every:
+            box = changed_box(mask, policy.crop_padding)
+            if box is not None:
+                left, top, right, bottom = box
+                if (right - left) * (bottom - top) <= policy.crop_max_fraction * mask.size:
+                    return self._send_crop(image, frame, box)
+
+        result = self._encode(image)
+        self._model_frame = frame
+        self._model_images = [result.image]
+        self._full_frame_bytes = base64_length(result.image)
+        self._crops_since_full_frame = 0
+        return result
+
+    def _encode(self, image, box: tuple[int, int, int, int] | None = None) -> ToolResult:
+        encoded = encode_image(image, self.encoding)
+        stored = self.images.put(encoded.data, encoded.media_type)
+        self.frame_store.add(encoded.data, encoded.media_type, box)
+        return ToolResult(image=stored)
+
+    def _send_crop(self, image, frame, box: tuple[int, int, int, int]) -> ToolResult:
+        left, top, right, bottom = box
+        result = self._encode(image.crop(box), box)
+        self._model_frame[top:bottom, left:right] = frame[top:bottom, left:right]
+        self._model_images.append(result.image)
+        self._crops_since_full_frame += 1
+        self.frame_stats.frames_cropped += 1
+        self.frame_stats.image_bytes_saved += max(0, self._full_frame_bytes - base64_length(result.image))
+        self.frame_stats.image_tokens_saved += image_tokens(*image.size) - image_tokens(right - left, bottom - top)
+        return result.replace(output=CROP_MESSAGE.format(left=left, top=top, right=right, bottom=bottom))
+
+    def close(self):
+        """Stop the input worker's thread. The tool cannot be used afterwards."""
+        self.input.close()
+
+    def forget_images(self, images: Iterable[ImageData]):
+        """
+        Tell the tool that images it returned are gone from the history the model
+        sees (thumbnailed, dropped or compacted away). If the screen as the model
+        last saw it was built from one of them, the next screenshot is compared
+        with nothing and sent in full.
+        """
+        forgotten = {id(image) for image in images}
+        if any(id(image) in forgotten for image in self._model_images):
+            self._model_frame = None
+            self._model_images = []
+            self._crops_since_full_frame = 0
+
+    async def _wait_for_settle(self, fixed_delay: bool = True):
+        """
+        Let the screen settle after an action before taking a screenshot. Without a
+        settle policy, or with a backend that cannot sample the screen cheaply,
+        wait a fixed _screenshot_delay instead if `fixed_delay`.
+        """
+        if self.settle is None or not self.screen_backend.cheap_sample:
+            if fixed_delay:
+                await asyncio.sleep(self._screenshot_delay)
+            return
+        waited = await wait_for_settle(self.screen_backend.sample, self.settle)
+        self.frame_stats.settles += 1
+        self.frame_stats.settle_time += waited
+        print(f"Screen settled after {waited:.2f}s")
+
+    async def _attach_screenshot(self, result: ToolResult, fixed_delay: bool = False) -> ToolResult:
+        """
+        Add a screenshot, taken once the screen has settled, to the result of an
+        action. `fixed_delay` is passed on to _wait_for_settle.
+        """
+        await self._wait_for_settle(fixed_delay=fixed_delay)
+        screenshot = await self.screenshot()
+        # an unchanged screen or a crop comes with a note for the model
+        output = "\n".join(text for text in (result.output, screenshot.output) if text)
+        return result.replace(output=output or None, image=screenshot.image)
 
     async def shell(self, command: str, take_screenshot=False) -> ToolResult:
         """Run a shell command and return the output, error, and optionally a screenshot."""
         _, stdout, stderr = await run(command)
-        base64_image = None
+        result = ToolResult(output=stdout, error=stderr)
 
         if take_screenshot:
-            # delay to let things settle before taking a screenshot
-            await asyncio.sleep(self._screenshot_delay)
-            base64_image = (await self.screenshot()).base64_image
+            result = await self._attach_screenshot(result, fixed_delay=True)
 
-        return ToolResult(output=stdout, error=stderr, base64_image=base64_image)
+        return result
 
     def scale_coordinates(self, source: ScalingSource, x: int, y: int) -> tuple[int, int]:
         """
@@ -0,0 +1,72 @@
+"""
+Encoding of screenshots for the API.
+
+Flat UI compresses well and stays sharp as PNG, while photos, videos and
+gradients are many times smaller as JPEG or WebP. Frames are PNG by default;
+with the "auto" format each frame is classified by counting its colors, which
+has not yet been checked against real desktop frames: anti-aliased text can
+push a text-heavy screen over the limit and have it sent as lossy JPEG.
+"""
+
+import io
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Literal
+
+from PIL import Image
+
+ImageFormat = Literal["auto", "png", "jpeg", "webp"]
+
+MEDIA_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Pillow releases the GIL while it encodes, so frames are encoded on a small pool of
+# their own instead of competing with everything else on the default executor
+encoder_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-encoder")
+
+
+@dataclass(frozen=True, kw_only=True)
+class ImageEncoding:
+    """
+    How screenshots are encoded, as lossless PNG by default. With format "auto"
+    (opt-in, see above), a frame that has more than `photo_colors` distinct colors
+    in a 1/4 scale sample counts as photographic and is encoded as
+    `photo_format`; anything else as PNG. `quality` applies to JPEG
+    and WebP, and `palette` quantizes PNGs to 256 colors, which makes them several
+    times smaller at the cost of some color fidelity.
+    """
+
+    format: ImageFormat = "png"
+    photo_format: Literal["jpeg", "webp"] = "jpeg"
+    quality: int = 80
+    palette: bool = False
+    photo_colors: int = 4096
+    png_compress_level: int = 6  # Pillow's default; 1 is about twice as fast but ~18% larger
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    data: bytes
+    media_type: str
+
+
+def is_photographic(image: Image.Image, max_colors: int) -> bool:
+    """Whether a frame has more than `max_colors` distinct colors, sampled at 1/4 scale."""
+    return image.reduce(4).getcolors(maxcolors=max_colors) is None
+
+
+def encode_image(image: Image.Image, encoding: ImageEncoding) -> EncodedImage:
+    """Encode a frame as the configured format. Blocking, so run it on encoder_pool."""
+    image_format = encoding.format
+    if image_format == "auto":
+        image_format = encoding.photo_format if is_photographic(image, encoding.photo_colors) else "png"
+
+    buffer = io.BytesIO()
+    if image_format == "png":
+        if encoding.palette:
+            image = image.quantize(256, method=Image.Quantize.FASTOCTREE)
+        image.save(buffer, format="PNG", compress_level=encoding.png_compress_level)
+    else:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffer, format=image_format.upper(), quality=encoding.quality)
+    return EncodedImage(buffer.getvalue(), MEDIA_TYPES[image_format])
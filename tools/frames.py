@@ -0,0 +1,236 @@
+"""
+Comparison of screen frames, so ComputerTool only sends the model what changed.
+
+Frames are compared as RGB NumPy arrays at the resolution the model sees. A
+pixel counts as changed when any of its channels moves by more than a threshold,
+which keeps JPEG-like noise from registering while a change of color at the
+same brightness still does. Settle detection compares grayscale samples, as it
+only needs to see that the screen is still moving.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+PIXELS_PER_IMAGE_TOKEN = 750  # the API bills images at width * height / 750 tokens
+# where screenshots used to be written, one file per frame, and never deleted
+LEGACY_OUTPUT_DIR = "/tmp/outputs"
+
+UNCHANGED_MESSAGE = "The screen has not changed since the last screenshot."
+CROP_MESSAGE = (
+    "Only part of the screen changed since the last screenshot. This image shows the region "
+    "from ({left}, {top}) to ({right}, {bottom}) in screen coordinates; the rest of the screen "
+    "is as it was."
+)
+
+
+@dataclass(frozen=True, kw_only=True)
+class FrameDiffPolicy:
+    """
+    When a new screenshot counts as the same screen as the last one sent.
+
+    A pixel has changed when any of its color channels differs by more than
+    `pixel_threshold` (0-255), and the screen is unchanged while at most
+    `unchanged_pixels` pixels have. That is none by default: a new line of small
+    text in a chat window changes only a couple of hundred pixels, so even a
+    caret-sized allowance risks hiding something the model is waiting for.
+
+    With `crop_changes`, a screen that did change is sent as just the bounding box
+    of its changed pixels (plus `crop_padding`), unless the box covers more than
+    `crop_max_fraction` of the screen or `full_frame_every` crops have been sent
+    since the last full frame. Keep more images in the history than
+    `full_frame_every`, so the last full frame is never pruned before its crops.
+    """
+
+    pixel_threshold: int = 16
+    unchanged_pixels: int = 0
+    crop_changes: bool = False
+    crop_max_fraction: float = 0.25
+    crop_padding: int = 8
+    full_frame_every: int = 5
+
+
+@dataclass(frozen=True, kw_only=True)
+class SettlePolicy:
+    """
+    How to tell that the screen has settled after an action: low resolution
+    samples `sample_width` pixels wide are taken every `interval` seconds, and the
+    screen has settled once `stable_samples` in a row match the one before them,
+    or after `timeout` seconds, whichever comes first.
+    """
+
+    interval: float = 0.05
+    stable_samples: int = 3
+    timeout: float = 3.0
+    sample_width: int = 192
+    pixel_threshold: int = 16
+    unchanged_fraction: float = 0.002
+
+
+@dataclass
+class FrameStats:
+    """What comparing frames saved"""
+
+    frames: int = 0
+    frames_unchanged: int = 0
+    frames_cropped: int = 0
+    image_bytes_saved: int = 0  # base64 bytes, against sending every frame in full
+    image_tokens_saved: int = 0
+    settles: int = 0
+    settle_time: float = 0.0  # seconds spent waiting for the screen to settle
+
+
+def to_rgb(image: Image.Image) -> np.ndarray:
+    """Convert a frame to the array frames are compared as."""
+    return np.array(image.convert("RGB"), dtype=np.int16)
+
+
+def to_gray(image: Image.Image) -> np.ndarray:
+    """Convert a settle sample to the array samples are compared as."""
+    return np.array(image.convert("L"), dtype=np.int16)
+
+
+def changed_mask(previous: np.ndarray | None, current: np.ndarray, pixel_threshold: int) -> np.ndarray | None:
+    """
+    Boolean mask of the pixels that changed between two frames, by their largest
+    channel difference for RGB frames, or None if there is no previous frame of
+    the same size to compare with.
+    """
+    if previous is None or previous.shape != current.shape:
+        return None
+    difference = np.abs(current - previous)
+    if difference.ndim == 3:
+        difference = difference.max(axis=2)
+    return difference > pixel_threshold
+
+
+def is_unchanged(mask: np.ndarray, policy: FrameDiffPolicy) -> bool:
+    return np.count_nonzero(mask) <= policy.unchanged_pixels
+
+
+def changed_box(mask: np.ndarray, padding: int = 0) -> tuple[int, int, int, int] | None:
+    """Bounding box (left, top, right, bottom) of the changed pixels, padded and clipped."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not rows.size:
+        return None
+    columns = np.flatnonzero(mask.any(axis=0))
+    height, width = mask.shape
+    return (
+        max(0, int(columns[0]) - padding),
+        max(0, int(rows[0]) - padding),
+        min(width, int(columns[-1]) + 1 + padding),
+        min(height, int(rows[-1]) + 1 + padding),
+    )
+
+
+@dataclass(frozen=True)
+class StoredFrame:
+    id: int
+    timestamp: float  # time.time() when the frame was sent
+    data: bytes
+    media_type: str
+    box: tuple[int, int, int, int] | None = None  # the region of the screen, for a crop
+
+
+class FrameStore:
+    """
+    The frames most recently sent to the model, kept in memory for debugging and
+    replay. Holds at most `max_frames` frames and `max_bytes` of image data, evicting
+    the least recently used first. Safe to use from several threads.
+    """
+
+    def __init__(self, max_frames: int = 100, max_bytes: int = 64 * 2**20):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._frames: OrderedDict[int, StoredFrame] = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def add(self, data: bytes, media_type: str, box: tuple[int, int, int, int] | None = None) -> StoredFrame:
+        with self._lock:
+            frame = StoredFrame(id=self._next_id, timestamp=time.time(), data=data, media_type=media_type, box=box)
+            self._next_id += 1
+            self._frames[frame.id] = frame
+            self.total_bytes += len(data)
+            while len(self._frames) > self.max_frames or (
+                self.total_bytes > self.max_bytes and len(self._frames) > 1
+            ):
+                _, evicted = self._frames.popitem(last=False)
+                self.total_bytes -= len(evicted.data)
+            return frame
+
+    def get(self, frame_id: int) -> StoredFrame | None:
+        with self._lock:
+            frame = self._frames.get(frame_id)
+            if frame is not None:
+                self._frames.move_to_end(frame_id)
+            return frame
+
+    def recent(self, n: int = 10) -> list[StoredFrame]:
+        """The last `n` frames sent, oldest first."""
+        with self._lock:
+            return sorted(self._frames.values(), key=lambda frame: frame.id)[-n:]
+
+    def dump(self, directory: str | Path) -> list[Path]:
+        """Write the stored frames to `directory` as frame_<id>.png (or .jpeg, .webp), for replay."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for frame in self.recent(len(self)):
+            path = directory / f"frame_{frame.id:06d}.{frame.media_type.removeprefix('image/')}"
+            path.write_bytes(frame.data)
+            paths.append(path)
+        return paths
+
+
+def remove_stale_screenshots(directory: str | Path = LEGACY_OUTPUT_DIR, max_age: float = 24 * 3600) -> int:
+    """
+    Delete the screenshot_<uuid>.png files earlier versions left behind, once
+    they are `max_age` seconds old, so files an agent of such a version is still
+    writing are left to it. Returns how many were deleted.
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in Path(directory).glob("screenshot_*.png"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:  # removed by someone else meanwhile
+            continue
+    return removed
+
+
+async def wait_for_settle(sample: Callable[[int], Image.Image], policy: SettlePolicy) -> float:
+    """
+    Wait until the screen stops changing, taking samples with `sample(width)` on a
+    worker thread. Returns the seconds waited.
+    """
+    start = time.perf_counter()
+    previous = to_gray(await asyncio.to_thread(sample, policy.sample_width))
+    stable = 0
+    while stable < policy.stable_samples and time.perf_counter() - start < policy.timeout:
+        await asyncio.sleep(policy.interval)
+        current = to_gray(await asyncio.to_thread(sample, policy.sample_width))
+        mask = changed_mask(previous, current, policy.pixel_threshold)
+        if mask is not None and np.count_nonzero(mask) <= policy.unchanged_fraction * mask.size:
+            stable += 1
+        else:
+            stable = 0
+        previous = current
+    return time.perf_counter() - start
+
+
+def image_tokens(width: int, height: int) -> int:
+    return round(width * height / PIXELS_PER_IMAGE_TOKEN)
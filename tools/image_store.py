@@ -0,0 +1,201 @@
+"""
+Content-addressed storage for the images in the message history.
+
+Every image a tool returns is stored once, keyed by a hash of its bytes, and the
+history holds an ImageRef to it. Identical frames (the same dialog shown again, a
+screenshot after a command that changed nothing on screen) share one entry and
+one ImageRef. The bytes are only read to encode an image for a request or to
+show it, so entries over the memory limit can be spilled to disk without the
+history noticing. The base64 forms of the images requests use are kept in a
+cache of their own with its own limit, so an image that stays in the history is
+not encoded again every turn. An entry is freed once no ImageRef to it is left.
+"""
+
+import base64
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from .base import ImageData
+
+IMAGE_SPILL_DIR_ENV = "IMAGE_SPILL_DIR"
+
+
+@dataclass
+class _Entry:
+    digest: str
+    size: int
+    data: bytes | None  # None once spilled
+    path: Path | None = None
+
+
+@dataclass(frozen=True)
+class ImageStoreStats:
+    images: int  # images stored, counting duplicates
+    unique_images: int  # distinct images stored
+    live_images: int  # distinct images still referenced
+    bytes_in_memory: int
+    bytes_on_disk: int
+    base64_bytes: int  # held by the base64 cache
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Images stored per distinct image"""
+        return self.images / self.unique_images if self.unique_images else 1.0
+
+
+class ImageRef(ImageData):
+    """An image in an ImageStore. Reads its bytes from the store on every access."""
+
+    def __init__(self, store: "ImageStore", digest: str, size: int, media_type: str):
+        super().__init__(b"", media_type)
+        self.store = store
+        self.digest = digest
+        self._size = size
+
+    @property
+    def data(self) -> bytes:
+        return self.store.load(self.digest)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def base64(self) -> str:
+        return self.store.base64(self.digest)
+
+
+class ImageStore:
+    """
+    Stores images by content. Keeps up to `max_memory_bytes` of them in memory;
+    with a `spill_dir`, the least recently stored images beyond that are written
+    there and read back when a request needs them, otherwise they all stay in
+    memory. Up to `max_base64_bytes` of base64 encodings are kept on top of
+    that, least recently used first out. Safe to use from several threads.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 256 * 2**20,
+        spill_dir: str | Path | None = None,
+        max_base64_bytes: int = 64 * 2**20,
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.max_base64_bytes = max_base64_bytes
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._base64: OrderedDict[str, str] = OrderedDict()
+        self.base64_bytes = 0
+        self._refs: weakref.WeakValueDictionary[str, ImageRef] = weakref.WeakValueDictionary()
+        # digests whose last ImageRef was collected; freed on the next put, since
+        # the garbage collector can run the finalizer while the lock is held
+        self._dead: list[tuple[str, _Entry]] = []
+        self._lock = threading.Lock()
+        self._images = 0
+        self._unique_images = 0
+        self.bytes_in_memory = 0
+        self.bytes_on_disk = 0
+
+    def put(self, data: bytes, media_type: str) -> ImageRef:
+        """Store an image, returning the existing ImageRef if it is already stored."""
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        with self._lock:
+            self._free_dead()
+            self._images += 1
+            ref = self._refs.get(digest)
+            if ref is not None:
+                self._entries.move_to_end(digest)
+                return ref
+            stale = self._entries.pop(digest, None)
+            if stale is not None:  # collected after _free_dead ran
+                self._forget(stale)
+            entry = _Entry(digest, len(data), data)
+            self._entries[digest] = entry
+            self._unique_images += 1
+            self.bytes_in_memory += entry.size
+            ref = ImageRef(self, digest, entry.size, media_type)
+            self._refs[digest] = ref
+            weakref.finalize(ref, self._dead.append, (digest, entry))
+            self._spill()
+            return ref
+
+    def load(self, digest: str) -> bytes:
+        with self._lock:
+            entry = self._entries[digest]
+            if entry.data is not None:
+                return entry.data
+            path = entry.path
+        return path.read_bytes()
+
+    def base64(self, digest: str) -> str:
+        """The base64 encoding of an image, from the cache if it is there."""
+        with self._lock:
+            encoded = self._base64.get(digest)
+            if encoded is not None:
+                self._base64.move_to_end(digest)
+                return encoded
+        encoded = base64.b64encode(self.load(digest)).decode()
+        with self._lock:
+            if digest in self._entries and digest not in self._base64:
+                self._base64[digest] = encoded
+                self.base64_bytes += len(encoded)
+                while self.base64_bytes > self.max_base64_bytes and self._base64:
+                    _, evicted = self._base64.popitem(last=False)
+                    self.base64_bytes -= len(evicted)
+        return encoded
+
+    def stats(self) -> ImageStoreStats:
+        with self._lock:
+            self._free_dead()
+            return ImageStoreStats(
+                images=self._images,
+                unique_images=self._unique_images,
+                live_images=len(self._entries),
+                bytes_in_memory=self.bytes_in_memory,
+                bytes_on_disk=self.bytes_on_disk,
+                base64_bytes=self.base64_bytes,
+            )
+
+    def _spill(self):
+        if self.spill_dir is None or self.bytes_in_memory <= self.max_memory_bytes:
+            return
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        for entry in self._entries.values():
+            if self.bytes_in_memory <= self.max_memory_bytes:
+                break
+            if entry.data is None:
+                continue
+            entry.path = self.spill_dir / f"image_{entry.digest}"
+            entry.path.write_bytes(entry.data)
+            entry.data = None
+            self.bytes_in_memory -= entry.size
+            self.bytes_on_disk += entry.size
+
+    def _free_dead(self):
+        while self._dead:
+            digest, entry = self._dead.pop()
+            # the same image may have been stored again since
+            if self._entries.get(digest) is not entry:
+                continue
+            del self._entries[digest]
+            self._forget(entry)
+
+    def _forget(self, entry: _Entry):
+        encoded = self._base64.pop(entry.digest, None)
+        if encoded is not None:
+            self.base64_bytes -= len(encoded)
+        if entry.data is None:
+            entry.path.unlink(missing_ok=True)
+            self.bytes_on_disk -= entry.size
+        else:
+            self.bytes_in_memory -= entry.size
+
+
+# shared by every ComputerTool by default, so agents watching the same screen
+# share their frames too
+image_store = ImageStore(spill_dir=os.environ.get(IMAGE_SPILL_DIR_ENV))
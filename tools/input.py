@@ -0,0 +1,406 @@
+"""
+Mouse and keyboard input for ComputerTool.
+
+A driver injects input in-process (CoreGraphics events on macOS, through
+pyautogui and Quartz), and an InputWorker runs its actions on one long-lived
+thread, in the order they were submitted, so an action costs a thread handoff
+instead of a process spawn. Pick a driver with INPUT_DRIVER=pyautogui|cliclick|
+recording, or pass it to ComputerTool.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Literal
+
+from .base import ToolError
+
+INPUT_DRIVER_ENV = "INPUT_DRIVER"
+
+MouseButton = Literal["left", "right", "middle"]
+
+TYPING_DELAY_MS = 12  # between groups of typed characters, so apps keep up
+TYPING_GROUP_SIZE = 20  # characters per keyboard event; macOS caps a unicode event at 20
+DRAG_DURATION = 0.2  # seconds; apps miss drags that arrive as a single jump
+
+
+def chunks(s: str, chunk_size: int) -> list[str]:
+    return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
+
+
+@dataclass(frozen=True, kw_only=True)
+class TypingPolicy:
+    """
+    How `type` actions enter text. Text of at least `paste_threshold` characters
+    is pasted through the clipboard, and whatever was on the clipboard is put back
+    `restore_delay` seconds later, once the app has read it. Shorter text, and
+    text with control characters other than newlines (a tab meant to move to the
+    next field, say), is typed key by key, as is everything with a threshold of None.
+    """
+
+    paste_threshold: int | None = 200
+    restore_delay: float = 0.25
+
+    def should_paste(self, text: str) -> bool:
+        if self.paste_threshold is None or len(text) < self.paste_threshold:
+            return False
+        return all(char == "\n" or char.isprintable() for char in text)
+
+
+@dataclass
+class TypingStats:
+    """How text was entered"""
+
+    actions: int = 0
+    characters_typed: int = 0
+    characters_pasted: int = 0
+    typing_time: float = 0.0  # seconds spent typing and pasting
+
+
+class InputDriver(metaclass=ABCMeta):
+    """Injects mouse and keyboard input. Every method blocks, so call them from the InputWorker."""
+
+    name: str
+    has_clipboard = False
+    paste_keys = ["command", "v"] if sys.platform == "darwin" else ["ctrl", "v"]
+
+    @abstractmethod
+    def position(self) -> tuple[int, int]:
+        """Where the cursor is now, in the units mouse coordinates use."""
+        ...
+
+    @abstractmethod
+    def move(self, x: int, y: int): ...
+
+    @abstractmethod
+    def click(self, button: MouseButton, count: int = 1):
+        """Click where the cursor is."""
+        ...
+
+    @abstractmethod
+    def drag(self, x: int, y: int):
+        """Press the left button where the cursor is, drag to (x, y) and let go."""
+        ...
+
+    @abstractmethod
+    def press(self, keys: list[str]):
+        """Press a key or, with several, a combination like ["command", "c"]."""
+        ...
+
+    @abstractmethod
+    def type_text(self, text: str): ...
+
+    def save_clipboard(self) -> Any:
+        """Whatever is on the clipboard, in a form restore_clipboard takes."""
+        raise ToolError(f"The {self.name} input driver has no clipboard")
+
+    def restore_clipboard(self, saved: Any):
+        raise ToolError(f"The {self.name} input driver has no clipboard")
+
+    def copy_text(self, text: str):
+        raise ToolError(f"The {self.name} input driver has no clipboard")
+
+    def paste(self, text: str, restore_delay: float):
+        """Paste text through the clipboard, putting back what was on it afterwards."""
+        saved = self.save_clipboard()
+        try:
+            self.copy_text(text)
+            self.press(self.paste_keys)
+            time.sleep(restore_delay)  # the app reads the clipboard after it handles the key press
+        finally:
+            self.restore_clipboard(saved)
+
+
+class PyAutoGUIDriver(InputDriver):
+    """
+    Posts input events in-process with pyautogui: CoreGraphics events on macOS
+    and XTest on X11. On macOS text is typed as unicode keyboard events, so any
+    character can be typed, not only those on the keyboard layout.
+    """
+
+    name = "pyautogui"
+
+    def __init__(self):
+        try:
+            import pyautogui
+        except Exception as e:  # on Linux it fails without a display, and not with an ImportError
+            raise ToolError(f"The pyautogui input driver is unavailable: {e}") from e
+        # the agent may well move to a screen corner on purpose
+        pyautogui.FAILSAFE = False
+        self._pyautogui = pyautogui
+        self._quartz = None
+        self._pasteboard = None
+        self._pyperclip = None
+        if sys.platform == "darwin":
+            try:
+                import AppKit
+                import Quartz
+
+                self._quartz = Quartz
+                self._appkit = AppKit
+                self._pasteboard = AppKit.NSPasteboard.generalPasteboard()
+            except ImportError:
+                pass
+        if self._pasteboard is None:
+            try:
+                import pyperclip
+
+                self._pyperclip = pyperclip
+            except ImportError:
+                pass
+        self.has_clipboard = self._pasteboard is not None or self._pyperclip is not None
+
+    def position(self) -> tuple[int, int]:
+        x, y = self._pyautogui.position()
+        return int(x), int(y)
+
+    def move(self, x: int, y: int):
+        self._pyautogui.moveTo(x, y, _pause=False)
+
+    def click(self, button: MouseButton, count: int = 1):
+        self._pyautogui.click(button=button, clicks=count, interval=0.0, _pause=False)
+
+    def drag(self, x: int, y: int):
+        self._pyautogui.dragTo(x, y, duration=DRAG_DURATION, button="left", _pause=False)
+
+    def press(self, keys: list[str]):
+        self._pyautogui.hotkey(*keys, _pause=False)
+
+    def type_text(self, text: str):
+        if self._quartz is None:
+            self._pyautogui.write(text, _pause=False)
+            return
+        for i, line in enumerate(text.split("\n")):
+            if i:
+                self._pyautogui.press("enter", _pause=False)
+            for chunk in chunks(line, TYPING_GROUP_SIZE):
+                self._type_unicode(chunk)
+                time.sleep(TYPING_DELAY_MS / 1000)
+
+    def save_clipboard(self) -> Any:
+        if self._pasteboard is None:
+            return self._pyperclip.paste()
+        # every representation of every item, so images and files survive as well as text
+        return [
+            {kind: item.dataForType_(kind) for kind in item.types()}
+            for item in self._pasteboard.pasteboardItems() or []
+        ]
+
+    def restore_clipboard(self, saved: Any):
+        if self._pasteboard is None:
+            self._pyperclip.copy(saved)
+            return
+        items = []
+        for representations in saved:
+            item = self._appkit.NSPasteboardItem.alloc().init()
+            for kind, data in representations.items():
+                item.setData_forType_(data, kind)
+            items.append(item)
+        self._pasteboard.clearContents()
+        if items:
+            self._pasteboard.writeObjects_(items)
+
+    def copy_text(self, text: str):
+        if self._pasteboard is None:
+            self._pyperclip.copy(text)
+            return
+        self._pasteboard.clearContents()
+        self._pasteboard.setString_forType_(text, self._appkit.NSPasteboardTypeString)
+
+    def _type_unicode(self, chunk: str):
+        quartz = self._quartz
+        length = len(chunk.encode("utf-16-le")) // 2  # the event counts UTF-16 code units
+        for key_down in (True, False):
+            event = quartz.CGEventCreateKeyboardEvent(None, 0, key_down)
+            quartz.CGEventKeyboardSetUnicodeString(event, length, chunk)
+            quartz.CGEventPost(quartz.kCGHIDEventTap, event)
+
+
+class CliclickDriver(InputDriver):
+    """The `cliclick` command line tool, one process spawn per action. Keys go through pyautogui."""
+
+    name = "cliclick"
+    has_clipboard = True  # through pbcopy and pbpaste, as text only
+
+    _click_commands = {("left", 1): "c", ("left", 2): "dc", ("right", 1): "rc", ("middle", 1): "mc"}
+
+    def position(self) -> tuple[int, int]:
+        x, y = self._run("p").split(",")
+        return int(x), int(y)
+
+    def move(self, x: int, y: int):
+        self._run(f"m:{x},{y}")
+
+    def click(self, button: MouseButton, count: int = 1):
+        if (button, count) not in self._click_commands:
+            raise ToolError(f"cliclick cannot {button} click {count} times")
+        self._run(f"{self._click_commands[button, count]}:.")
+
+    def drag(self, x: int, y: int):
+        self._run("dd:.", f"dm:{x},{y}", f"du:{x},{y}")
+
+    def press(self, keys: list[str]):
+        import pyautogui
+
+        pyautogui.hotkey(*keys, _pause=False)
+
+    def type_text(self, text: str):
+        self._run(*(arg for chunk in chunks(text, TYPING_GROUP_SIZE) for arg in (f"w:{TYPING_DELAY_MS}", f"t:{chunk}")))
+
+    def save_clipboard(self) -> Any:
+        return subprocess.run(["pbpaste"], capture_output=True, text=True).stdout
+
+    def restore_clipboard(self, saved: Any):
+        self.copy_text(saved)
+
+    def copy_text(self, text: str):
+        subprocess.run(["pbcopy"], input=text, text=True, check=True)
+
+    def _run(self, *commands: str) -> str:
+        result = subprocess.run(["cliclick", *commands], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise ToolError(f"cliclick failed: {result.stderr}")
+        return result.stdout.strip()
+
+
+class RecordingDriver(InputDriver):
+    """
+    Records actions instead of performing them, for running ComputerTool and the
+    input worker without a display. `events` holds an (action, *args) tuple per call.
+    """
+
+    name = "recording"
+    has_clipboard = True
+
+    def __init__(self, position: tuple[int, int] = (0, 0)):
+        self.events: list[tuple[Any, ...]] = []
+        self.clipboard = ""
+        self._position = position
+
+    def position(self) -> tuple[int, int]:
+        self.events.append(("position",))
+        return self._position
+
+    def move(self, x: int, y: int):
+        self.events.append(("move", x, y))
+        self._position = (x, y)
+
+    def click(self, button: MouseButton, count: int = 1):
+        self.events.append(("click", button, count))
+
+    def drag(self, x: int, y: int):
+        self.events.append(("drag", x, y))
+        self._position = (x, y)
+
+    def press(self, keys: list[str]):
+        self.events.append(("press", *keys))
+
+    def type_text(self, text: str):
+        self.events.append(("type", text))
+
+    def save_clipboard(self) -> Any:
+        return self.clipboard
+
+    def restore_clipboard(self, saved: Any):
+        self.clipboard = saved
+
+    def copy_text(self, text: str):
+        self.events.append(("copy", text))
+        self.clipboard = text
+
+
+INPUT_DRIVERS: dict[str, type[InputDriver]] = {
+    driver.name: driver for driver in (PyAutoGUIDriver, CliclickDriver, RecordingDriver)
+}
+
+
+def get_input_driver(name: str | None = None) -> InputDriver:
+    """
+    Create the named driver, or the one named by INPUT_DRIVER. The default is
+    pyautogui, falling back to cliclick on macOS. The recording driver is only
+    used when asked for, as its actions succeed without doing anything.
+    """
+    name = name or os.environ.get(INPUT_DRIVER_ENV)
+    if name:
+        if name not in INPUT_DRIVERS:
+            raise ToolError(f"Unknown input driver {name}, expected one of {', '.join(INPUT_DRIVERS)}")
+        return INPUT_DRIVERS[name]()
+    try:
+        return PyAutoGUIDriver()
+    except ToolError:
+        if sys.platform != "darwin":
+            raise
+        return CliclickDriver()
+
+
+def _timed(action: Callable[..., Any], *args) -> float:
+    """Run an action, returning the seconds it took, without the time spent queued."""
+    start = time.perf_counter()
+    action(*args)
+    return time.perf_counter() - start
+
+
+class InputWorker:
+    """
+    Runs a driver's actions one at a time on a dedicated thread, in the order they
+    were submitted, and keeps track of where the cursor was last put, so the
+    cursor position is only asked of the driver until the first move. `typing`
+    decides whether text is typed or pasted.
+    """
+
+    def __init__(self, driver: InputDriver, typing: TypingPolicy = TypingPolicy()):
+        self.driver = driver
+        self.typing = typing
+        self.typing_stats = TypingStats()
+        self.cursor: tuple[int, int] | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="input")
+
+    async def move(self, x: int, y: int):
+        await self._submit(self.driver.move, x, y)
+        self.cursor = (x, y)
+
+    async def click(self, button: MouseButton, count: int = 1):
+        await self._submit(self.driver.click, button, count)
+
+    async def drag(self, x: int, y: int):
+        # a drag that fails halfway leaves the cursor somewhere in between
+        self.cursor = None
+        await self._submit(self.driver.drag, x, y)
+        self.cursor = (x, y)
+
+    async def press(self, keys: list[str]):
+        await self._submit(self.driver.press, keys)
+
+    async def type_text(self, text: str) -> tuple[bool, float]:
+        """Type or paste text. Returns whether it was pasted and the seconds it took."""
+        paste = self.driver.has_clipboard and self.typing.should_paste(text)
+        if paste:
+            seconds = await self._submit(_timed, self.driver.paste, text, self.typing.restore_delay)
+            self.typing_stats.characters_pasted += len(text)
+        else:
+            seconds = await self._submit(_timed, self.driver.type_text, text)
+            self.typing_stats.characters_typed += len(text)
+        self.typing_stats.actions += 1
+        self.typing_stats.typing_time += seconds
+        return paste, seconds
+
+    async def cursor_position(self) -> tuple[int, int]:
+        if self.cursor is None:
+            self.cursor = await self._submit(self.driver.position)
+        return self.cursor
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, action: Callable[..., Any], *args) -> Any:
+        try:
+            return await asyncio.wrap_future(self._executor.submit(action, *args))
+        except ToolError:
+            raise
+        except Exception as e:
+            raise ToolError(f"Input failed: {e}") from e
@@ -0,0 +1,102 @@
+"""
+Live output from tools that are still running, for whoever is watching.
+
+Tools hand their output to an `on_output` callable piece by piece as it is
+produced. OutputCoalescer batches those pieces up and passes them on at a
+limited rate, so a command that prints thousands of lines costs a few updates a
+second and never makes the tool wait on the UI.
+"""
+
+import asyncio
+import contextlib
+import inspect
+import time
+from collections.abc import Awaitable, Callable
+
+OutputCallback = Callable[[str], None]
+
+
+class OutputCoalescer:
+    """
+    Collects output and calls `flush` with everything collected at most every
+    `interval` seconds, from a task of its own. `flush` may be a plain function
+    or a coroutine function. If more than `max_chars` build up between flushes,
+    only the end is kept. Call close() when the tool is done to flush the rest.
+    Errors from `flush` are printed and otherwise ignored.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[str], Awaitable[None] | None],
+        interval: float = 0.25,
+        max_chars: int = 16_000,
+    ):
+        self._flush = flush
+        self.interval = interval
+        self.max_chars = max_chars
+        self._pending: list[str] = []
+        self._pending_chars = 0
+        self._dropped = False  # whether output was left out since the last flush
+        self._last_flush = 0.0
+        self._closing = False
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    def __call__(self, text: str):
+        if not text:
+            return
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars > 2 * self.max_chars:
+            # a flood of output between flushes is cut down to its end as it comes
+            self._pending = ["".join(self._pending)[-self.max_chars :]]
+            self._pending_chars = self.max_chars
+            self._dropped = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def close(self):
+        self._closing = True
+        if self._task is not None:
+            # waited for rather than cancelled, so a flush in progress finishes
+            # with the text it took, and the last flush never overtakes it
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self._emit()
+
+    async def _flush_later(self):
+        while self._pending and not self._closing:
+            delay = self._last_flush + self.interval - time.monotonic()
+            if delay > 0:
+                # cut short by close(), which flushes what is left itself
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                if self._closing:
+                    return
+            await self._emit()
+
+    async def _emit(self):
+        text = self._take()
+        if not text:
+            return
+        self._last_flush = time.monotonic()
+        # live output is only for watching; a failing UI must not fail the tool
+        try:
+            result = self._flush(text)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            print(f"Error showing tool output: {e}")
+
+    def _take(self) -> str:
+        text = "".join(self._pending)
+        if len(text) > self.max_chars:
+            text = text[-self.max_chars :]
+            self._dropped = True
+        if self._dropped and text:
+            text = "...\n" + text
+        self._pending = []
+        self._pending_chars = 0
+        self._dropped = False
+        return text
@@ -1,6 +1,9 @@
 """Utility to run shell commands asynchronously with a timeout."""
 
 import asyncio
+import sys
+
+from .capture import OutputCapture
 
 TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
 MAX_RESPONSE_LEN: int = 16000
@@ -20,18 +23,26 @@ async def run(
     timeout: float | None = 120.0,  # seconds
     truncate_after: int | None = MAX_RESPONSE_LEN,
 ):
-    """Run a shell command asynchronously with a timeout."""
+    """
+    Run a shell command asynchronously with a timeout. Output is read as it is
+    written, and of each stream only the first and last `truncate_after / 2`
+    bytes are kept, with a note of how much was left out in between.
+    """
     process = await asyncio.create_subprocess_shell(
         cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
     )
+    stdout, stderr = _capture(truncate_after), _capture(truncate_after)
 
     try:
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return (
-            process.returncode or 0,
-            maybe_truncate(stdout.decode(), truncate_after=truncate_after),
-            maybe_truncate(stderr.decode(), truncate_after=truncate_after),
+        await asyncio.wait_for(
+            asyncio.gather(
+                _drain(process.stdout, stdout),
+                _drain(process.stderr, stderr),
+                process.wait(),
+            ),
+            timeout=timeout,
         )
+        return process.returncode or 0, stdout.text(TRUNCATED_MESSAGE), stderr.text(TRUNCATED_MESSAGE)
     except asyncio.TimeoutError as exc:
         try:
             process.kill()
@@ -40,3 +51,15 @@ async def run(
         raise TimeoutError(
             f"Command '{cmd}' timed out after {timeout} seconds"
         ) from exc
+
+
+def _capture(truncate_after: int | None) -> OutputCapture:
+    if not truncate_after:
+        return OutputCapture(head_bytes=sys.maxsize, tail_bytes=0)
+    return OutputCapture(head_bytes=truncate_after // 2, tail_bytes=truncate_after - truncate_after // 2)
+
+
+async def _drain(stream: asyncio.StreamReader, capture: OutputCapture):
+    """Read a stream to its end, handing it to `capture` a chunk at a time."""
+    while chunk := await stream.read(2**16):
+        capture.write(chunk)
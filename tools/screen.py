@@ -0,0 +1,223 @@
+"""
+Screen capture backends for ComputerTool.
+
+A backend grabs the screen into a Pillow image in memory; resizing and encoding
+(see encoder.py) happen in Pillow as well, so a screenshot needs no temp files and, with the Quartz
+backend, no process spawns. Pick one with SCREEN_BACKEND=quartz|screencapture|
+imagegrab|synthetic, or pass it to ComputerTool.
+"""
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from abc import ABCMeta, abstractmethod
+
+from PIL import Image, ImageDraw
+
+from .base import ToolError
+
+SCREEN_BACKEND_ENV = "SCREEN_BACKEND"
+
+
+class ScreenBackend(metaclass=ABCMeta):
+    """Grabs the screen into memory."""
+
+    name: str
+    # whether sample() is cheap enough to poll every few tens of milliseconds
+    cheap_sample: bool = True
+
+    @abstractmethod
+    def size(self) -> tuple[int, int]:
+        """Size of the screen in the units mouse coordinates use (points on macOS)."""
+        ...
+
+    @abstractmethod
+    def capture(self) -> Image.Image:
+        """Grab the whole screen. Blocking, so call it from a worker thread."""
+        ...
+
+    def sample(self, width: int) -> Image.Image:
+        """A cheap low resolution grayscale frame, about `width` pixels wide. Blocking."""
+        image = self.capture()
+        return image.reduce(max(1, image.width // width)).convert("L")
+
+
+class QuartzBackend(ScreenBackend):
+    """
+    Copies the main display's framebuffer in-process with CoreGraphics.
+    Needs pyobjc-framework-Quartz and the screen recording permission.
+    """
+
+    name = "quartz"
+
+    def __init__(self):
+        try:
+            import Quartz
+        except ImportError as e:
+            raise ToolError("The quartz screen backend needs pyobjc-framework-Quartz") from e
+        self._quartz = Quartz
+        self._display = Quartz.CGMainDisplayID()
+
+    def size(self) -> tuple[int, int]:
+        bounds = self._quartz.CGDisplayBounds(self._display)
+        return int(bounds.size.width), int(bounds.size.height)
+
+    def capture(self) -> Image.Image:
+        quartz = self._quartz
+        image_ref = quartz.CGDisplayCreateImage(self._display)
+        if image_ref is None:
+            raise ToolError("Failed to take screenshot: no screen recording permission?")
+        width = quartz.CGImageGetWidth(image_ref)
+        height = quartz.CGImageGetHeight(image_ref)
+        bytes_per_row = quartz.CGImageGetBytesPerRow(image_ref)
+        data = quartz.CGDataProviderCopyData(quartz.CGImageGetDataProvider(image_ref))
+        # 32 bit little endian pixels with the alpha byte skipped, rows padded to bytes_per_row
+        return Image.frombuffer("RGB", (width, height), bytes(data), "raw", "BGRX", bytes_per_row, 1)
+
+    def sample(self, width: int) -> Image.Image:
+        # CoreGraphics draws the framebuffer into a small grayscale bitmap, so only
+        # the sample's pixels are copied out
+        quartz = self._quartz
+        image_ref = quartz.CGDisplayCreateImage(self._display)
+        if image_ref is None:
+            raise ToolError("Failed to sample the screen: no screen recording permission?")
+        height = max(1, round(width * quartz.CGImageGetHeight(image_ref) / quartz.CGImageGetWidth(image_ref)))
+        context = quartz.CGBitmapContextCreate(
+            None, width, height, 8, 0, quartz.CGColorSpaceCreateDeviceGray(), quartz.kCGImageAlphaNone
+        )
+        quartz.CGContextSetInterpolationQuality(context, quartz.kCGInterpolationLow)
+        quartz.CGContextDrawImage(context, quartz.CGRectMake(0, 0, width, height), image_ref)
+        sample_ref = quartz.CGBitmapContextCreateImage(context)
+        bytes_per_row = quartz.CGImageGetBytesPerRow(sample_ref)
+        data = quartz.CGDataProviderCopyData(quartz.CGImageGetDataProvider(sample_ref))
+        return Image.frombuffer("L", (width, height), bytes(data), "raw", "L", bytes_per_row, 1)
+
+
+class ScreencaptureBackend(ScreenBackend):
+    """The `screencapture` command line tool, one process spawn per frame."""
+
+    name = "screencapture"
+    cheap_sample = False  # a sample would be a whole capture
+
+    def size(self) -> tuple[int, int]:
+        import pyautogui
+
+        return tuple(pyautogui.size())
+
+    def capture(self) -> Image.Image:
+        with tempfile.NamedTemporaryFile(suffix=".png") as file:
+            result = subprocess.run(["screencapture", "-x", file.name], capture_output=True, text=True)
+            if result.returncode != 0:
+                raise ToolError(f"Failed to take screenshot: {result.stderr}")
+            image = Image.open(file.name)
+            image.load()  # reads the pixels before the file is deleted
+            return image
+
+
+class ImageGrabBackend(ScreenBackend):
+    """
+    Pillow's ImageGrab: the X11 framebuffer on Linux (e.g. an Xvfb display) and
+    `screencapture` again on macOS.
+    """
+
+    name = "imagegrab"
+    cheap_sample = sys.platform != "darwin"  # which runs `screencapture` for every grab
+
+    def __init__(self):
+        from PIL import ImageGrab
+
+        self._grab = ImageGrab.grab
+        self._size: tuple[int, int] | None = None
+
+    def size(self) -> tuple[int, int]:
+        if self._size is None:
+            self._size = self._grab().size
+        return self._size
+
+    def capture(self) -> Image.Image:
+        try:
+            return self._grab()
+        except OSError as e:
+            raise ToolError(f"Failed to take screenshot: {e}") from e
+
+
+class SyntheticBackend(ScreenBackend):
+    """
+    A generated desktop-like screen, for running and benchmarking the screenshot
+    pipeline without a display. `scale` is the pixel density, so the default
+    frames are the size of a Retina MacBook's. Every capture moves the cursor.
+    """
+
+    name = "synthetic"
+
+    def __init__(self, size: tuple[int, int] = (1440, 900), scale: int = 2, seed: int = 0):
+        self._size = size
+        self._scale = scale
+        self._frame_count = 0
+        self._base = self._render_desktop(random.Random(seed))
+
+    def size(self) -> tuple[int, int]:
+        return self._size
+
+    def capture(self) -> Image.Image:
+        frame = self._base.copy()
+        self._frame_count += 1
+        x = (self._frame_count * 37) % frame.width
+        y = (self._frame_count * 23) % frame.height
+        cursor = 12 * self._scale
+        ImageDraw.Draw(frame).polygon(
+            [(x, y), (x, y + cursor), (x + cursor // 2, y + cursor * 3 // 4)], fill="black", outline="white"
+        )
+        return frame
+
+    def _render_desktop(self, rng: random.Random) -> Image.Image:
+        width, height = self._size[0] * self._scale, self._size[1] * self._scale
+        image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        draw = ImageDraw.Draw(image)
+        menu_bar = 24 * self._scale
+        draw.rectangle((0, 0, width, menu_bar), fill=(236, 236, 236))
+        for _ in range(6):  # windows full of text
+            left, top = rng.randrange(0, width // 2), rng.randrange(menu_bar, height // 2)
+            right, bottom = left + rng.randrange(width // 4, width // 2), top + rng.randrange(height // 4, height // 2)
+            draw.rectangle((left, top, right, bottom), fill=(255, 255, 255), outline=(180, 180, 180))
+            draw.rectangle((left, top, right, top + 28 * self._scale), fill=(220, 220, 220))
+            for line_y in range(top + 36 * self._scale, bottom - 10 * self._scale, 18 * self._scale):
+                words = " ".join("x" * rng.randrange(2, 10) for _ in range(rng.randrange(3, 12)))
+                draw.text((left + 8 * self._scale, line_y), words, fill=(rng.randrange(80), 40, 40))
+        return image
+
+
+SCREEN_BACKENDS: dict[str, type[ScreenBackend]] = {
+    backend.name: backend
+    for backend in (QuartzBackend, ScreencaptureBackend, ImageGrabBackend, SyntheticBackend)
+}
+
+
+def get_screen_backend(name: str | None = None) -> ScreenBackend:
+    """
+    Create the named backend, or the one named by SCREEN_BACKEND. The default is
+    quartz on macOS, falling back to screencapture without pyobjc, and imagegrab
+    elsewhere.
+    """
+    name = name or os.environ.get(SCREEN_BACKEND_ENV)
+    if name:
+        if name not in SCREEN_BACKENDS:
+            raise ToolError(f"Unknown screen backend {name}, expected one of {', '.join(SCREEN_BACKENDS)}")
+        return SCREEN_BACKENDS[name]()
+    if sys.platform == "darwin":
+        try:
+            return QuartzBackend()
+        except ToolError:
+            return ScreencaptureBackend()
+    return ImageGrabBackend()
+
+
+def scale_frame(image: Image.Image, size: tuple[int, int]) -> Image.Image:
+    """Resize a captured frame to the size the model sees."""
+    if image.size == size:
+        return image
+    # reducing_gap lets Pillow shrink Retina frames by an integer factor
+    # first, which is cheaper than resampling them at full size
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)